@@ -40,7 +40,8 @@ from .environment import get_etc_ros_dir, get_log_dir, get_ros_home, \
     get_test_results_dir, on_ros_path
 from .manifest import InvalidManifest, Manifest, parse_manifest_file
 from .rospack import expand_to_packages, get_package_name, \
-    get_stack_version_by_dir, list_by_path, RosPack, RosStack
+    get_stack_version_by_dir, list_by_path, PackageResolver, RosPack, \
+    RosStack
 
 # same version as in:
 # - setup.py
@@ -53,6 +54,6 @@ __all__ = (
     'get_ros_package_path', 'get_ros_paths', 'get_ros_root',
     'get_test_results_dir', 'on_ros_path',
     'InvalidManifest', 'Manifest', 'parse_manifest_file',
-    'get_package_name', 'RosPack', 'RosStack',
+    'get_package_name', 'PackageResolver', 'RosPack', 'RosStack',
     'list_by_path', 'expand_to_packages', 'get_stack_version_by_dir',
 )
@@ -0,0 +1,505 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2011, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compiled dependency graph of the resources of a :class:`rospkg.RosPack`
+or :class:`rospkg.RosStack`, for answering many dependency queries.
+"""
+
+import heapq
+import json
+from collections import deque
+from xml.sax.saxutils import escape, quoteattr
+
+from .common import ResourceNotFound, STACK_FILE
+from .manifest import InvalidManifest
+from .rospack import _iter_components
+
+
+class CyclicDependency(Exception):
+    """
+    Resources cannot be ordered as they depend on each other.
+    """
+
+    def __init__(self, msg, names=None):
+        super(CyclicDependency, self).__init__(msg)
+        #: names of the resources that depend on each other, ``[str]``
+        self.names = names
+
+
+def _iter_bits(bits):
+    """
+    :returns: indices of the bits set in *bits*, in ascending order,
+      ``[int]``
+    """
+    return [i for i, b in enumerate(bin(bits)[:1:-1]) if b == '1']
+
+
+class DependencyGraph(object):
+    """
+    Implicit dependencies of all resources of a manager, computed once.
+    Resources are assigned integer ids and each set of dependencies is
+    stored as the bits of an ``int``, so that membership tests,
+    intersections and counts do not depend on the number of resources
+    involved.  The graph does not reflect changes made on disk after
+    it was built, see :meth:`ManifestManager.get_dependency_graph`.
+    """
+
+    def __init__(self, manager):
+        """
+        Load the manifests of all resources of *manager*.  Resources
+        with an invalid manifest and dependencies that cannot be
+        located are recorded, and only queries that involve them raise.
+
+        :param manager: :class:`rospkg.RosPack` or :class:`rospkg.RosStack`
+        """
+        # ids are positions in list(), followed by missing dependencies
+        self._names = list(manager.list())
+        self._resource_count = len(self._names)
+        self._ids = dict((name, i) for i, name in enumerate(self._names))
+        #: ids of direct dependencies, by id
+        self._edges = []
+        # {id: exception raised when loading its manifest}
+        self._errors = {}
+        while len(self._edges) < len(self._names):
+            name = self._names[len(self._edges)]
+            try:
+                depends = [d.name for d in manager.get_manifest(name).depends]
+            except (InvalidManifest, ResourceNotFound) as e:
+                self._errors[len(self._edges)] = e
+                depends = []
+            edges = []
+            for d in depends:
+                if d not in self._ids:
+                    self._ids[d] = len(self._names)
+                    self._names.append(d)
+                edges.append(self._ids[d])
+            self._edges.append(edges)
+        self._broken = 0
+        for i in self._errors:
+            self._broken |= 1 << i
+        self._closures = self._compute_closures()
+
+    def _compute_closures(self):
+        """
+        :returns: implicit dependencies, by id, ``[int]``
+        """
+        closures = [None] * len(self._names)
+        for i in range(len(self._names)):
+            if closures[i] is not None:
+                continue
+            for component in _iter_components(i, self._edges.__getitem__,
+                                              lambda j: closures[j] is not None):
+                bits = 0
+                for j in component:
+                    for k in self._edges[j]:
+                        # members of the component are not computed yet
+                        bits |= (1 << k) | (closures[k] or 0)
+                for j in component:
+                    closures[j] = bits
+        return closures
+
+    def _get_closure(self, name):
+        """
+        :returns: implicit dependencies of *name*, ``int``
+        :raises: :exc:`InvalidManifest` If *name* or any of its
+          dependencies have an invalid manifest
+        :raises: :exc:`ResourceNotFound` If *name* or any of its
+          dependencies cannot be located
+        """
+        i = self._ids.get(name)
+        if i is None:
+            raise ResourceNotFound(name)
+        broken = (self._closures[i] | 1 << i) & self._broken
+        if broken:
+            raise self._errors[_iter_bits(broken)[0]]
+        return self._closures[i]
+
+    def _get_names(self, bits):
+        return [self._names[i] for i in _iter_bits(bits)]
+
+    def depends(self, a, b):
+        """
+        :param a: resource name, ``str``
+        :param b: resource name, ``str``
+        :returns: ``True`` if *a* depends on *b*, explicitly or
+          implicitly, ``bool``
+        :raises: :exc:`InvalidManifest`, :exc:`ResourceNotFound` See
+          :meth:`closure`
+        """
+        i = self._ids.get(b)
+        return i is not None and bool(self._get_closure(a) >> i & 1)
+
+    def closure(self, name):
+        """
+        Get the explicit and implicit dependencies of a resource, like
+        :meth:`ManifestManager.get_depends`.
+
+        :param name: resource name, ``str``
+        :returns: names of dependencies, in order of precedence, ``[str]``
+        :raises: :exc:`InvalidManifest` If *name* or any of its
+          dependencies have an invalid manifest
+        :raises: :exc:`ResourceNotFound` If *name* or any of its
+          dependencies cannot be located
+        """
+        return self._get_names(self._get_closure(name))
+
+    def common_dependencies(self, a, b):
+        """
+        :param a: resource name, ``str``
+        :param b: resource name, ``str``
+        :returns: names of resources that both *a* and *b* depend on,
+          in order of precedence, ``[str]``
+        :raises: :exc:`InvalidManifest`, :exc:`ResourceNotFound` See
+          :meth:`closure`
+        """
+        return self._get_names(self._get_closure(a) & self._get_closure(b))
+
+    def why(self, a, b, k=1):
+        """
+        Explain why *a* depends on *b* with the shortest chains of
+        direct dependencies from *a* to *b*.  Only resources that
+        depend on *b* are explored.
+
+        :param a: resource name, ``str``
+        :param b: resource name, ``str``
+        :param k: maximum number of chains, ``int``
+        :returns: up to *k* chains without repeated resources (except
+          *b* if it is *a*), shortest first, each a list of names
+          from *a* to *b*, ``[[str]]``
+        :raises: :exc:`InvalidManifest` If *a* has an invalid manifest
+        :raises: :exc:`ResourceNotFound` If *a* cannot be located
+        """
+        i = self._ids.get(a)
+        if i is None:
+            raise ResourceNotFound(a)
+        if i in self._errors:
+            raise self._errors[i]
+        target = self._ids.get(b)
+        if target is None or k < 1:
+            return []
+        path = self._find_path(i, target, set(), set())
+        if path is None:
+            return []
+        # Yen's algorithm: deviate from each found chain at each step
+        paths = [path]
+        candidates = []
+        seen = set([tuple(path)])
+        while len(paths) < k:
+            previous = paths[-1]
+            for j in range(len(previous) - 1):
+                root = previous[:j + 1]
+                blocked_edges = set((p[j], p[j + 1]) for p in paths if p[:j + 1] == root)
+                spur = self._find_path(previous[j], target, set(root[:-1]), blocked_edges)
+                if spur is not None and tuple(root[:-1] + spur) not in seen:
+                    seen.add(tuple(root[:-1] + spur))
+                    heapq.heappush(candidates, (len(root) + len(spur), root[:-1] + spur))
+            if not candidates:
+                break
+            paths.append(heapq.heappop(candidates)[1])
+        return [[self._names[j] for j in p] for p in paths]
+
+    def _find_path(self, source, target, blocked_nodes, blocked_edges):
+        """
+        Breadth-first search of a shortest chain of direct
+        dependencies.
+
+        :returns: ids from *source* to *target*, or ``None``, ``[int]``
+        """
+        parents = {source: None}
+        queue = deque([source])
+        while queue:
+            n = queue.popleft()
+            for m in self._edges[n]:
+                if (n, m) in blocked_edges:
+                    continue
+                if m == target:
+                    path = [m]
+                    while n is not None:
+                        path.append(n)
+                        n = parents[n]
+                    return path[::-1]
+                # skip resources that do not depend on the target
+                if m in parents or m in blocked_nodes or not self._closures[m] >> target & 1:
+                    continue
+                parents[m] = n
+                queue.append(m)
+        return None
+
+    def _select(self, names):
+        """
+        :param names: resource names, or ``None`` for all resources
+        :returns: ids of *names*, in ascending order, ``[int]``
+        :raises: :exc:`InvalidManifest`, :exc:`ResourceNotFound` See
+          :meth:`closure`
+        """
+        if names is None:
+            names = self._names[:self._resource_count]
+        for name in names:
+            self._get_closure(name)
+        return sorted(set(self._ids[name] for name in names))
+
+    def _schedule(self, ids, weights=None):
+        """
+        Compute, for each selected resource, the length of the longest
+        chain of selected resources that ends with it, following
+        implicit dependencies.  Unselected resources are traversed
+        without counting, so orderings through them are kept.
+
+        :param ids: selected ids, ``[int]``
+        :param weights: ``{name: float}``, see :meth:`critical_path`
+        :returns: ``{id: (level, finish, predecessor)}`` of the selected
+          ids, with the number of resources and the sum of their
+          weights along the heaviest chain, and the previous id on that
+          chain or ``None``
+        :raises: :exc:`CyclicDependency`
+        """
+        selected = set(ids)
+        # {id: (level, finish, last selected id)} of visited ids
+        done = {}
+        schedule = {}
+        for i in ids:
+            if i in done:
+                continue
+            for component in _iter_components(i, self._edges.__getitem__, done.__contains__):
+                # at most one selected resource per component
+                members = [j for j in component if j in selected]
+                if len(members) > 1:
+                    names = [self._names[j] for j in sorted(members)]
+                    raise CyclicDependency('cyclic dependency between %s' % ', '.join(names), names)
+                level, finish, last = 0, 0, None
+                for j in component:
+                    for k in self._edges[j]:
+                        # members of the component are not done yet
+                        if k not in done:
+                            continue
+                        level_k, finish_k, last_k = done[k]
+                        level = max(level, level_k)
+                        if finish_k > finish or last is None and last_k is not None:
+                            finish, last = finish_k, last_k
+                if members:
+                    j = members[0]
+                    weight = 1 if weights is None else weights.get(self._names[j], 1)
+                    schedule[j] = (level + 1, finish + weight, last)
+                    level, finish, last = schedule[j][0], schedule[j][1], j
+                for j in component:
+                    done[j] = (level, finish, last)
+        return schedule
+
+    def waves(self, names=None):
+        """
+        Group resources in waves that can be processed in parallel,
+        e.g. built, after all previous waves were processed.  Each
+        resource is in the first wave after all resources of *names*
+        it depends on, explicitly or implicitly.
+
+        :param names: resource names, or ``None`` for all resources,
+          ``[str]``
+        :returns: names of resources in each wave, in order of
+          precedence, ``[[str]]``
+        :raises: :exc:`CyclicDependency` If resources of *names*
+          depend on each other
+        :raises: :exc:`InvalidManifest`, :exc:`ResourceNotFound` See
+          :meth:`closure`
+        """
+        schedule = self._schedule(self._select(names))
+        waves = []
+        for i in sorted(schedule):
+            level = schedule[i][0]
+            while len(waves) < level:
+                waves.append([])
+            waves[level - 1].append(self._names[i])
+        return waves
+
+    def topological_order(self, names=None):
+        """
+        Order resources so that each one comes after all resources of
+        *names* it depends on.  The order is deterministic: it is the
+        concatenation of :meth:`waves`.
+
+        :param names: resource names, or ``None`` for all resources,
+          ``[str]``
+        :returns: names of resources, ``[str]``
+        :raises: :exc:`CyclicDependency`, :exc:`InvalidManifest`,
+          :exc:`ResourceNotFound` See :meth:`waves`
+        """
+        return [name for wave in self.waves(names) for name in wave]
+
+    def critical_path(self, names=None, weights=None):
+        """
+        Find the chain of resources of *names* that takes longest to
+        process, e.g. build, one after the other, which bounds the time
+        needed to process all of them in parallel.
+
+        :param names: resource names, or ``None`` for all resources,
+          ``[str]``
+        :param weights: estimated cost of processing each resource,
+          ``{str: float}``.  Resources without an estimate cost ``1``.
+        :returns: total cost and names of the resources of the chain,
+          in order, ``(float, [str])``
+        :raises: :exc:`CyclicDependency`, :exc:`InvalidManifest`,
+          :exc:`ResourceNotFound` See :meth:`waves`
+        """
+        schedule = self._schedule(self._select(names), weights)
+        if not schedule:
+            return 0, []
+        # the first of the heaviest chains, in order of precedence
+        i = max(sorted(schedule), key=lambda j: schedule[j][1])
+        cost = schedule[i][1]
+        path = []
+        while i is not None:
+            path.append(self._names[i])
+            i = schedule[i][2]
+        return cost, path[::-1]
+
+
+class _DotWriter(object):
+
+    def __init__(self, f):
+        self._f = f
+
+    def _quote(self, text):
+        return '"%s"' % text.replace('\\', '\\\\').replace('"', '\\"')
+
+    def begin(self):
+        self._f.write('digraph dependencies {\n')
+
+    def node(self, node_id, name, node_type):
+        self._f.write('  %s [label=%s, type=%s];\n' % (
+            self._quote(node_id), self._quote(name), self._quote(node_type)))
+
+    def edge(self, source, target, edge_type):
+        self._f.write('  %s -> %s [type=%s];\n' % (
+            self._quote(source), self._quote(target), self._quote(edge_type)))
+
+    def end(self):
+        self._f.write('}\n')
+
+
+class _JsonLinesWriter(object):
+
+    def __init__(self, f):
+        self._f = f
+
+    def begin(self):
+        pass
+
+    def node(self, node_id, name, node_type):
+        self._f.write(json.dumps({'kind': 'node', 'id': node_id, 'name': name, 'type': node_type}) + '\n')
+
+    def edge(self, source, target, edge_type):
+        self._f.write(json.dumps({'kind': 'edge', 'source': source, 'target': target, 'type': edge_type}) + '\n')
+
+    def end(self):
+        pass
+
+
+class _GraphMLWriter(object):
+
+    def __init__(self, f):
+        self._f = f
+
+    def begin(self):
+        self._f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+            '  <key id="name" for="node" attr.name="name" attr.type="string"/>\n'
+            '  <key id="type" for="all" attr.name="type" attr.type="string"/>\n'
+            '  <graph id="dependencies" edgedefault="directed">\n')
+
+    def node(self, node_id, name, node_type):
+        self._f.write('    <node id=%s><data key="name">%s</data><data key="type">%s</data></node>\n' % (
+            quoteattr(node_id), escape(name), escape(node_type)))
+
+    def edge(self, source, target, edge_type):
+        self._f.write('    <edge source=%s target=%s><data key="type">%s</data></edge>\n' % (
+            quoteattr(source), quoteattr(target), escape(edge_type)))
+
+    def end(self):
+        self._f.write('  </graph>\n</graphml>\n')
+
+
+_WRITERS = {
+    'dot': _DotWriter,
+    'jsonl': _JsonLinesWriter,
+    'graphml': _GraphMLWriter,
+}
+
+
+def export_graph(manager, f, format='dot'):
+    """
+    Write the dependency graph of all resources of a manager to a
+    file-like object, one resource at a time.  Manifests that are not
+    cached by *manager* are read without being cached, so memory use
+    does not grow with the number of resources beyond the locations
+    *manager* holds anyway.
+
+    Nodes have a ``type`` of ``package`` or ``stack``, or ``rosdep``
+    for system dependencies, whose ids are prefixed with ``rosdep:``.
+    Edges have a ``type`` of ``depend`` or ``rosdep``.  Resources with
+    an invalid manifest have no edges, and dependencies that cannot be
+    located are nodes of the type of *manager* without edges.
+
+    :param manager: :class:`rospkg.RosPack` or :class:`rospkg.RosStack`
+    :param f: file-like object opened for writing text
+    :param format: ``'dot'``, ``'jsonl'`` (one JSON object per line)
+      or ``'graphml'``, ``str``
+    :raises: :exc:`ValueError` If *format* is invalid
+    """
+    if format not in _WRITERS:
+        raise ValueError('invalid format %r, expected one of %s' % (format, ', '.join(sorted(_WRITERS))))
+    writer = _WRITERS[format](f)
+    resource_type = 'stack' if manager._manifest_name == STACK_FILE else 'package'
+    names = manager.list()
+    resources = set(names)
+    # only the names of nodes that are not resources are kept
+    extra = set()
+    writer.begin()
+    for name in names:
+        writer.node(name, name, resource_type)
+    for name in names:
+        try:
+            manifest = manager._read_manifest(name)
+        except (InvalidManifest, ResourceNotFound):
+            continue
+        for d in manifest.depends:
+            if d.name not in resources and d.name not in extra:
+                extra.add(d.name)
+                writer.node(d.name, d.name, resource_type)
+            writer.edge(name, d.name, 'depend')
+        for d in manifest.rosdeps:
+            node_id = 'rosdep:' + d.name
+            if node_id not in extra:
+                extra.add(node_id)
+                writer.node(node_id, d.name, 'rosdep')
+            writer.edge(name, node_id, 'rosdep')
+    writer.end()
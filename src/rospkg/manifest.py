@@ -38,6 +38,7 @@ stack.xml.
 import os
 import sys
 import xml.dom.minidom as dom
+from xml.parsers import expat
 
 from .common import MANIFEST_FILE, PACKAGE_FILE, STACK_FILE
 
@@ -55,128 +56,258 @@ class InvalidManifest(Exception):
     pass
 
 
-def _get_nodes_by_name(n, name):
-    return [t for t in n.childNodes if t.nodeType == t.ELEMENT_NODE and t.tagName == name]
+class _ManifestElement(object):
+    """
+    Child element of the ``<package>``/``<stack>`` element, or of one
+    of its ``<export>`` elements, as recorded by
+    :class:`_ManifestHandler`.
+    """
+    __slots__ = ['tag', 'attrs', 'text', 'children', 'node']
 
+    def __init__(self, tag, attrs):
+        self.tag = tag
+        self.attrs = attrs
+        # contents of the text nodes of the element, excluding CDATA sections
+        self.text = []
+        self.children = []
+        # DOM node of the element, only built for the elements that
+        # are exposed as such, see :meth:`_ManifestHandler.start_element`
+        self.node = None
 
-def _check_optional(name, allowXHTML=False, merge_multiple=False):
-    """
-    Validator for optional elements.
+    def get_text(self):
+        return ''.join(self.text)
 
-    :raise: :exc:`InvalidManifest` If validation fails
+
+def _parse_ns_name(name):
+    """
+    :returns: namespace URI, local name, prefix and qualified name of
+      a name reported by expat, ``(str, str, str, str)``
     """
-    def check(n, filename):
-        n = _get_nodes_by_name(n, name)
-        if len(n) > 1 and not merge_multiple:
-            raise InvalidManifest("Invalid manifest file [%s]: must have a single '%s' element" % (filename, name))
-        if n:
-            values = []
-            for child in n:
-                if allowXHTML:
-                    values.append(''.join([x.toxml() for x in child.childNodes]))
-                else:
-                    values.append(_get_text(child.childNodes).strip())
-            return ', '.join(values)
-    return check
+    parts = name.split(' ')
+    if len(parts) == 3:
+        uri, localname, prefix = parts
+        return uri, localname, prefix, '%s:%s' % (prefix, localname)
+    elif len(parts) == 2:
+        uri, localname = parts
+        return uri, localname, dom.EMPTY_PREFIX, localname
+    raise ValueError("Unsupported syntax: spaces in URIs not supported: %r" % name)
 
 
-def _check_required(name, allowXHTML=False, merge_multiple=False):
+class _ManifestHandler(object):
     """
-    Validator for required elements.
-
-    :raise: :exc:`InvalidManifest` If validation fails
+    Records the elements of a manifest in a single pass of expat.
+    The parser is set up the way :func:`xml.dom.minidom.parseString`
+    sets it up, so that documents are accepted and rejected alike and
+    the DOM nodes built for descriptions and unknown tags are the same.
     """
-    def check(n, filename):
-        n = _get_nodes_by_name(n, name)
-        if not n:
-            return ''
-        if len(n) != 1 and not merge_multiple:
-            raise InvalidManifest("Invalid manifest file: must have only one '%s' element" % name)
-        values = []
-        for child in n:
-            if allowXHTML:
-                values.append(''.join([x.toxml() for x in child.childNodes]))
+
+    def __init__(self, build_dom=True):
+        """
+        :param build_dom: If ``False``, do not build DOM nodes for
+          descriptions and unknown tags, ``bool``
+        """
+        self.root = None
+        self._build_dom = build_dom
+        self._document = None
+        # _ManifestElement of each open element, None if not recorded
+        self._stack = []
+        # open elements of the DOM subtree being built
+        self._nodes = []
+        self._prefixes = []
+        self._cdata = self._cdata_continue = False
+
+    def parse(self, string):
+        """
+        :returns: document element, :class:`_ManifestElement`
+        :raises: :exc:`xml.parsers.expat.ExpatError`
+        """
+        parser = expat.ParserCreate(namespace_separator=' ')
+        parser.namespace_prefixes = True
+        parser.buffer_text = True
+        parser.ordered_attributes = True
+        parser.specified_attributes = True
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.StartNamespaceDeclHandler = self.start_namespace_decl
+        parser.CharacterDataHandler = self.character_data
+        parser.StartCdataSectionHandler = self.start_cdata_section
+        parser.EndCdataSectionHandler = self.end_cdata_section
+        parser.CommentHandler = self.comment
+        parser.ProcessingInstructionHandler = self.processing_instruction
+        parser.ExternalEntityRefHandler = lambda *args: 1
+        parser.Parse(string, True)
+        return self.root
+
+    def start_namespace_decl(self, prefix, uri):
+        self._prefixes.append((prefix, uri))
+
+    def start_element(self, name, attributes):
+        depth = len(self._stack)
+        # record the children of the document element and of <export>
+        record = depth < 2 or (depth == 2 and self._stack[1].tag == 'export')
+        # the DOM is only needed for XHTML descriptions and unknown tags
+        build = bool(self._nodes)
+        if not record and not build:
+            self._stack.append(None)
+            del self._prefixes[:]
+            return
+        qname = _parse_ns_name(name)[3] if ' ' in name else name
+        if depth == 1 and self._build_dom and (qname == 'description' or qname not in VALID):
+            build = True
+        attrs = {}
+        for prefix, uri in self._prefixes:
+            attrs['xmlns:' + prefix if prefix else 'xmlns'] = uri
+        for i in range(0, len(attributes), 2):
+            aname = attributes[i]
+            attrs[_parse_ns_name(aname)[3] if ' ' in aname else aname] = attributes[i + 1]
+        element = None
+        if record:
+            element = _ManifestElement(qname, attrs)
+            if depth == 0:
+                self.root = element
+            else:
+                self._stack[-1].children.append(element)
+        self._stack.append(element)
+        if build:
+            node = self._create_element(name, attributes)
+            if self._nodes:
+                self._nodes[-1].appendChild(node)
+            else:
+                element.node = node
+            self._nodes.append(node)
+        del self._prefixes[:]
+
+    def _create_element(self, name, attributes):
+        if self._document is None:
+            self._document = dom.Document()
+        if ' ' in name:
+            uri, localname, prefix, qname = _parse_ns_name(name)
+        else:
+            uri, localname, prefix, qname = dom.EMPTY_NAMESPACE, None, dom.EMPTY_PREFIX, name
+        node = dom.Element(qname, uri, prefix, localname)
+        node.ownerDocument = self._document
+        for prefix, uri in self._prefixes:
+            if prefix:
+                a = dom.Attr('xmlns:' + prefix, dom.XMLNS_NAMESPACE, prefix, 'xmlns')
             else:
-                values.append(_get_text(child.childNodes).strip())
-        return ', '.join(values)
-    return check
+                a = dom.Attr('xmlns', dom.XMLNS_NAMESPACE, 'xmlns', dom.EMPTY_PREFIX)
+            a.value = uri
+            a.ownerDocument = self._document
+            node.setAttributeNode(a)
+        for i in range(0, len(attributes), 2):
+            aname = attributes[i]
+            if ' ' in aname:
+                uri, localname, prefix, qname = _parse_ns_name(aname)
+                a = dom.Attr(qname, uri, localname, prefix)
+            else:
+                a = dom.Attr(aname, dom.EMPTY_NAMESPACE, aname, dom.EMPTY_PREFIX)
+            a.value = attributes[i + 1]
+            a.ownerDocument = self._document
+            node.setAttributeNode(a)
+        return node
+
+    def end_element(self, name):
+        self._stack.pop()
+        if self._nodes:
+            self._nodes.pop()
+
+    def character_data(self, data):
+        element = self._stack[-1] if self._stack else None
+        if element is not None and not self._cdata:
+            element.text.append(data)
+        if not self._nodes:
+            return
+        # same merging of adjacent data as minidom
+        child_nodes = self._nodes[-1].childNodes
+        if self._cdata:
+            if self._cdata_continue and child_nodes[-1].nodeType == dom.Node.CDATA_SECTION_NODE:
+                child_nodes[-1].appendData(data)
+                return
+            node = self._document.createCDATASection(data)
+            self._cdata_continue = True
+        elif child_nodes and child_nodes[-1].nodeType == dom.Node.TEXT_NODE:
+            child_nodes[-1].data += data
+            return
+        else:
+            node = self._document.createTextNode(data)
+        self._nodes[-1].appendChild(node)
+
+    def start_cdata_section(self):
+        self._cdata = True
+        self._cdata_continue = False
+
+    def end_cdata_section(self):
+        self._cdata = self._cdata_continue = False
+
+    def comment(self, data):
+        if self._nodes:
+            self._nodes[-1].appendChild(self._document.createComment(data))
+
+    def processing_instruction(self, target, data):
+        if self._nodes:
+            self._nodes[-1].appendChild(self._document.createProcessingInstruction(target, data))
+
+
+def _check_single(tags, name, filename):
+    """
+    :raises: :exc:`InvalidManifest` If there is more than one element
+    """
+    if len(tags.get(name, [])) > 1:
+        raise InvalidManifest("Invalid manifest file [%s]: must have a single '%s' element" % (filename, name))
 
 
-def _check_platform(n, filename):
+def _get_single(tags, name):
     """
-    Validator for manifest platform.
-    :raise: :exc:`InvalidManifest` If validation fails
+    :returns: stripped text of the element, ``None`` if missing
     """
-    platforms = _get_nodes_by_name(n, 'platform')
-    try:
-        vals = [(p.attributes['os'].value, p.attributes['version'].value, p.getAttribute('notes')) for p in platforms]
-    except KeyError as e:
-        raise InvalidManifest("<platform> tag is missing required '%s' attribute" % str(e))
-    return [Platform(*v) for v in vals]
+    if name in tags:
+        return tags[name][0].get_text().strip()
 
 
-def _check_depends(type_, n, filename):
+def _group_children(p):
     """
-    Validator for manifest depends.
-    :raise: :exc:`InvalidManifest` If validation fails
+    :returns: children of *p* by tag, ``{str: [_ManifestElement]}``
     """
-    nodes = _get_nodes_by_name(n, 'depend')
-    # TDS 20110419:  this is a hack.
-    # rosbuild2 has a <depend thirdparty="depname"/> tag,
-    # which is confusing this subroutine with
-    # KeyError: 'package'
-    # for now, explicitly don't consider thirdparty depends
-    depends = [e.attributes for e in nodes if 'thirdparty' not in e.attributes.keys()]
-    try:
-        depend_names = [d[type_].value for d in depends]
-    except KeyError:
-        raise InvalidManifest("Invalid manifest file [%s]: depends is missing '%s' attribute" % (filename, type_))
+    tags = {}
+    for e in p.children:
+        tags.setdefault(e.tag, []).append(e)
+    return tags
 
-    return [Depend(name, type_) for name in depend_names]
 
-
-def _check_rosdeps(n, filename):
+def _set_details(m, p, tags):
     """
-    Validator for stack rosdeps.
+    Set the fields of *m* that are decoded on demand by
+    :class:`_LazyManifest`, from a document that passed validation.
 
-    :raises: :exc:`InvalidManifest` If validation fails
+    :param p: document element parsed with DOM nodes, :class:`_ManifestElement`
+    :param tags: result of :func:`_group_children`
     """
-    try:
-        nodes = _get_nodes_by_name(n, 'rosdep')
-        rosdeps = [e.attributes for e in nodes]
-        names = [d['name'].value for d in rosdeps]
-        return [RosDep(n) for n in names]
-    except KeyError:
-        raise InvalidManifest("invalid rosdep tag in [%s]" % (filename))
-
-
-def _attrs(node):
-    attrs = {}
-    for k in node.attributes.keys():
-        attrs[k] = node.attributes.get(k).value
-    return attrs
+    m.description = None
+    m.brief = ''
+    if 'description' in tags:
+        description = tags['description'][0]
+        m.description = ''.join([x.toxml() for x in description.node.childNodes])
+        m.brief = description.attrs.get('brief') or ''
 
+    m.license = m.license_url = ''
+    if 'license' in tags:
+        m.license = tags['license'][0].get_text().strip()
+        m.license_url = tags['license'][0].attrs.get('url') or ''
 
-def _check_exports(n, filename):
-    ret_val = []
-    for e in _get_nodes_by_name(n, 'export'):
-        elements = [c for c in e.childNodes if c.nodeType == c.ELEMENT_NODE]
-        ret_val.extend([Export(t.tagName, _attrs(t), _get_text(t.childNodes)) for t in elements])
-    return ret_val
+    m.status = 'unreviewed'
+    m.notes = ''
+    if 'review' in tags:
+        m.status = tags['review'][0].attrs.get('status') or ''
+        m.notes = tags['review'][0].attrs.get('notes') or ''
 
+    m.author = None
+    if 'author' in tags:
+        m.author = ', '.join([e.get_text().strip() for e in tags['author']])
+    m.url = _get_single(tags, 'url')
+    m.version = _get_single(tags, 'version')
 
-def _check(name, merge_multiple=False):
-    """
-    Generic validator for text-based tags.
-    """
-    if name in REQUIRED:
-        if name in ALLOWXHTML:
-            return _check_required(name, True, merge_multiple)
-        return _check_required(name, merge_multiple=merge_multiple)
-    elif name in OPTIONAL:
-        if name in ALLOWXHTML:
-            return _check_optional(name, True, merge_multiple)
-        return _check_optional(name, merge_multiple=merge_multiple)
+    # store unrecognized tags
+    m.unknown_tags = [e.node for e in p.children if e.tag not in VALID]
 
 
 class Export(object):
@@ -361,23 +492,126 @@ class Manifest(object):
         return vals
 
 
-def _get_text(nodes):
+# fields of a Manifest that _LazyManifest decodes on first access
+_LAZY_FIELDS = ['description', 'brief', 'author', 'license', 'license_url', 'url',
+                'version', 'status', 'notes', 'unknown_tags']
+
+
+def _lazy_field(name):
+    def get(self):
+        if self._source is not None:
+            self._decode()
+        return self._details[name]
+
+    def set_(self, value):
+        if self._source is not None:
+            self._decode()
+        self._details[name] = value
+    return property(get, set_)
+
+
+class _LazyManifest(Manifest):
     """
-    DOM utility routine for getting contents of text nodes
+    :class:`Manifest` whose fields that are not needed for dependency
+    queries are decoded from the manifest contents, which are kept
+    until then, the first time one of them is accessed.
     """
-    return "".join([n.data for n in nodes if n.nodeType == n.TEXT_NODE])
+    __slots__ = ['_source', '_details']
+
+    description = _lazy_field('description')
+    brief = _lazy_field('brief')
+    author = _lazy_field('author')
+    license = _lazy_field('license')
+    license_url = _lazy_field('license_url')
+    url = _lazy_field('url')
+    version = _lazy_field('version')
+    status = _lazy_field('status')
+    notes = _lazy_field('notes')
+    unknown_tags = _lazy_field('unknown_tags')
+
+    def __init__(self, type_='package', filename=None, is_catkin=False):
+        # contents of the manifest, None once decoded
+        self._source = None
+        self._details = {}
+        super(_LazyManifest, self).__init__(type_, filename, is_catkin)
+
+    def __getstate__(self):
+        fields = dict((name, getattr(self, name)) for name in Manifest.__slots__ if name not in _LAZY_FIELDS)
+        return self._source, self._details, fields
+
+    def __setstate__(self, state):
+        self._source, self._details, fields = state
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def _decode(self):
+        # the contents already passed validation in parse_manifest()
+        p = _ManifestHandler().parse(self._source)
+        m = Manifest(self.type, self.filename)
+        _set_details(m, p, _group_children(p))
+        self._details = dict((name, getattr(m, name)) for name in _LAZY_FIELDS)
+        self._source = None
+
+
+# fields of a Manifest that are stored as they are by _manifest_to_dict()
+_PLAIN_FIELDS = ['description', 'brief', 'author', 'license', 'licenses', 'license_url',
+                 'url', 'version', 'status', 'notes']
+
+
+def _manifest_to_dict(m):
+    """
+    :returns: JSON-serializable fields of *m*, or ``None`` if *m* has
+      unknown tags, which are DOM elements, ``dict``
+    """
+    if m.unknown_tags:
+        return None
+    data = dict((attr, getattr(m, attr)) for attr in _PLAIN_FIELDS)
+    data['licenses'] = [str(license_) for license_ in m.licenses]
+    data['type'] = m.type
+    data['filename'] = m.filename
+    data['is_catkin'] = m.is_catkin
+    data['depends'] = [(d.name, d.type) for d in m.depends]
+    data['rosdeps'] = [r.name for r in m.rosdeps]
+    data['platforms'] = [(p.os, p.version, p.notes) for p in m.platforms]
+    data['exports'] = [(e.tag, dict(e.attrs), e.str) for e in m.exports]
+    return data
+
+
+def _manifest_from_dict(data):
+    """
+    :param data: result of :func:`_manifest_to_dict`
+    :returns: :class:`Manifest`
+    """
+    m = Manifest(data['type'], data['filename'], data['is_catkin'])
+    for attr in _PLAIN_FIELDS:
+        setattr(m, attr, data[attr])
+    m.depends = [Depend(name, type_) for name, type_ in data['depends']]
+    m.rosdeps = [RosDep(name) for name in data['rosdeps']]
+    m.platforms = [Platform(*p) for p in data['platforms']]
+    m.exports = [Export(tag, dict(attrs), str_) for tag, attrs, str_ in data['exports']]
+    return m
 
 
 _static_rosdep_view = None
 
 
-def parse_manifest_file(dirpath, manifest_name, rospack=None):
+def _has_rosdep_view():
+    """
+    :returns: ``True`` if the dependencies of ``package.xml``
+      manifests are classified with rosdep, which is only known once
+      one of them was parsed, ``bool``
+    """
+    return bool(_static_rosdep_view)
+
+
+def parse_manifest_file(dirpath, manifest_name, rospack=None, lazy=False):
     """
     Parse manifest file (package, stack).  Type will be inferred from manifest_name.
 
     :param dirpath: directory of manifest file, ``str``
     :param manifest_name: ``MANIFEST_FILE`` or ``STACK_FILE``, ``str``
     :param rospack: a RosPack instance to identify local packages as ROS packages
+    :param lazy: see :func:`parse_manifest`, ignored for ``package.xml``
 
     :returns: return :class:`Manifest` instance, populated with parsed fields
     :raises: :exc:`InvalidManifest`
@@ -434,16 +668,21 @@ def parse_manifest_file(dirpath, manifest_name, rospack=None):
 
     with open(filename, 'rb') as f:
         data = f.read().decode('utf-8')
-    return parse_manifest(manifest_name, data, filename)
+    return parse_manifest(manifest_name, data, filename, lazy=lazy)
 
 
-def parse_manifest(manifest_name, string, filename='string'):
+def parse_manifest(manifest_name, string, filename='string', lazy=False):
     """
     Parse manifest string contents.
 
     :param manifest_name: ``MANIFEST_FILE`` or ``STACK_FILE``, ``str``
     :param string: manifest.xml contents, ``str``
     :param filename: full file path for debugging, ``str``
+    :param lazy: If ``True``, only decode the fields needed for
+      dependency queries (depends, rosdeps, platforms and exports)
+      and decode the others on first access, see
+      :class:`_LazyManifest`.  The manifest is validated in full
+      either way.
     :returns: return parsed :class:`Manifest`
     """
     if manifest_name == MANIFEST_FILE:
@@ -452,53 +691,53 @@ def parse_manifest(manifest_name, string, filename='string'):
         type_ = 'stack'
 
     try:
-        d = dom.parseString(string)
+        p = _ManifestHandler(build_dom=not lazy).parse(string)
     except Exception as e:
         raise InvalidManifest("[%s] invalid XML: %s" % (filename, e))
 
-    m = Manifest(type_, filename)
-    p = _get_nodes_by_name(d, type_)
-    if len(p) != 1:
+    if lazy:
+        m = _LazyManifest(type_, filename)
+    else:
+        m = Manifest(type_, filename)
+    if p.tag != type_:
         raise InvalidManifest("manifest [%s] must have a single '%s' element" % (filename, type_))
-    p = p[0]
-    m.description = _check('description')(p, filename)
-    m.brief = ''
-    try:
-        tag = _get_nodes_by_name(p, 'description')[0]
-        m.brief = tag.getAttribute('brief') or ''
-    except:
-        # means that 'description' tag is missing
-        pass
-
-    m.depends = _check_depends(type_, p, filename)
-    m.rosdeps = _check_rosdeps(p, filename)
-    m.platforms = _check_platform(p, filename)
-    m.exports = _check_exports(p, filename)
-    m.license = _check('license')(p, filename)
-    m.license_url = ''
-    try:
-        tag = _get_nodes_by_name(p, 'license')[0]
-        m.license_url = tag.getAttribute('url') or ''
-    except:
-        pass  # manifest is missing required 'license' tag
+    tags = _group_children(p)
 
-    m.status = 'unreviewed'
-    try:
-        tag = _get_nodes_by_name(p, 'review')[0]
-        m.status = tag.getAttribute('status') or ''
-    except:
-        pass  # manifest is missing optional 'review status' tag
+    _check_single(tags, 'description', filename)
+
+    # TDS 20110419:  this is a hack.
+    # rosbuild2 has a <depend thirdparty="depname"/> tag,
+    # which is confusing this subroutine with
+    # KeyError: 'package'
+    # for now, explicitly don't consider thirdparty depends
+    depend_names = []
+    for e in tags.get('depend', []):
+        if 'thirdparty' in e.attrs:
+            continue
+        if type_ not in e.attrs:
+            raise InvalidManifest("Invalid manifest file [%s]: depends is missing '%s' attribute" % (filename, type_))
+        depend_names.append(e.attrs[type_])
+    m.depends = [Depend(name, type_) for name in depend_names]
+
+    rosdep_names = []
+    for e in tags.get('rosdep', []):
+        if 'name' not in e.attrs:
+            raise InvalidManifest("invalid rosdep tag in [%s]" % (filename))
+        rosdep_names.append(e.attrs['name'])
+    m.rosdeps = [RosDep(name) for name in rosdep_names]
 
-    m.notes = ''
     try:
-        tag = _get_nodes_by_name(p, 'review')[0]
-        m.notes = tag.getAttribute('notes') or ''
-    except:
-        pass  # manifest is missing optional 'review notes' tag
+        vals = [(e.attrs['os'], e.attrs['version'], e.attrs.get('notes', '')) for e in tags.get('platform', [])]
+    except KeyError as e:
+        raise InvalidManifest("<platform> tag is missing required '%s' attribute" % str(e))
+    m.platforms = [Platform(*v) for v in vals]
 
-    m.author = _check('author', True)(p, filename)
-    m.url = _check('url')(p, filename)
-    m.version = _check('version')(p, filename)
+    m.exports = [Export(t.tag, t.attrs, t.get_text()) for e in tags.get('export', []) for t in e.children]
+
+    if len(tags.get('license', [])) > 1:
+        raise InvalidManifest("Invalid manifest file: must have only one 'license' element")
+    _check_single(tags, 'url', filename)
+    _check_single(tags, 'version', filename)
 
     # do some validation on what we just parsed
     if type_ == 'stack':
@@ -507,8 +746,10 @@ def parse_manifest(manifest_name, string, filename='string'):
         if m.rosdeps:
             raise InvalidManifest("stack manifests are not allowed to have rosdeps")
 
-    m.is_catkin = bool(_get_nodes_by_name(p, 'catkin')) or bool(_get_nodes_by_name(p, 'name'))
+    m.is_catkin = 'catkin' in tags or 'name' in tags
 
-    # store unrecognized tags
-    m.unknown_tags = [e for e in p.childNodes if e.nodeType == e.ELEMENT_NODE and e.tagName not in VALID]
+    if lazy:
+        m._source = string
+    else:
+        _set_details(m, p, tags)
     return m
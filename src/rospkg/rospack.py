@@ -30,23 +30,360 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import errno
+import hashlib
+import json
+import logging
 import os
+import stat
+import tempfile
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 from threading import Lock
 
-try:
-    from xml.etree.cElementTree import ElementTree
-except ImportError:
-    from xml.etree.ElementTree import ElementTree
+from xml.etree.ElementTree import ParseError
+from xml.parsers import expat
 
 from .common import MANIFEST_FILE, PACKAGE_FILE, ResourceNotFound, STACK_FILE
-from .environment import get_ros_paths
-from .manifest import InvalidManifest, parse_manifest_file
+from .environment import get_ros_home, get_ros_paths
+from .manifest import _has_rosdep_view, _manifest_from_dict, _manifest_to_dict, InvalidManifest, parse_manifest_file
 from .stack import InvalidStack, parse_stack_file
 
 _cache_lock = Lock()
+_logger = logging.getLogger(__name__)
+
+CATKIN_IGNORE = 'CATKIN_IGNORE'
+NOSUBDIRS_FILE = 'rospack_nosubdirs'
+# files whose presence changes how a directory is crawled
+_MARKER_FILES = frozenset([CATKIN_IGNORE, MANIFEST_FILE, NOSUBDIRS_FILE, PACKAGE_FILE, STACK_FILE])
+# a directory containing one of these is never descended into
+_LEAF_MARKER_FILES = frozenset([CATKIN_IGNORE, MANIFEST_FILE, NOSUBDIRS_FILE, PACKAGE_FILE])
+
+# bump whenever the layout of the persistent workspace index changes
+_WORKSPACE_INDEX_VERSION = 3
+# bump whenever the layout of the persistent manifest store changes
+_MANIFEST_STORE_VERSION = 2
+# rewrite the manifest store once it holds this many superseded entries
+_MANIFEST_STORE_SLACK = 1000
+# directories modified this close to (or after) the start of a crawl
+# may have changed while they were being listed, so an index that
+# depends on them is not written to disk
+_RACY_MTIME_NS = 2 * 10 ** 9
+# number of workspace indexes and manifest stores kept for managers
+# created later, beyond those in use by existing managers
+_SHARED_LIMIT = 8
+
+
+def _get_mtime(path):
+    """
+    :returns: modification time of *path* in nanoseconds or ``None``
+      if *path* does not exist, ``int``
+    """
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _scan_dir(d):
+    """
+    List the directory *d* in a single pass.  Only the entries that
+    affect the crawl are returned and hidden entries are skipped.
+    Entries are classified by their directory entry type, so this does
+    not stat regular files.
+
+    :returns: (marker files, subdirectory names, number of hidden
+      subdirectories) or ``None`` if *d* cannot be listed, ``({str},
+      [str], int)``
+    """
+    markers = set()
+    subdirs = []
+    hidden = 0
+    try:
+        entries = os.scandir(d)
+    except OSError:
+        return None
+    with entries:
+        for entry in entries:
+            name = entry.name
+            try:
+                # follows symlinks, like os.walk(followlinks=True)
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if name[0] == '.':
+                hidden += is_dir
+            elif is_dir:
+                subdirs.append(name)
+            elif name in _MARKER_FILES:
+                markers.add(name)
+    return markers, subdirs, hidden
+
+
+class _HeaderComplete(Exception):
+    pass
 
 
-def list_by_path(manifest_name, path, cache):
+def _read_package_header(filename):
+    """
+    Read the name of a package and whether it is a metapackage from
+    its ``package.xml`` without building a tree.  Parsing stops as
+    soon as the name has been read and either a metapackage tag or the
+    end of the ``<export>`` element has been seen.  Equivalent to
+    ``root.findtext('name')`` and ``root.find('./export/metapackage')``
+    on the document ``root``, given the single ``<export>`` element
+    allowed in ``package.xml``.
+
+    :param filename: path of ``package.xml``, ``str``
+    :returns: (unstripped package name or ``None`` if there is no
+      ``<name>`` element, ``True`` if the package is a metapackage),
+      ``(str, bool)``
+    :raises: :exc:`xml.etree.ElementTree.ParseError`
+    """
+    # namespaced tags never match plain names, as with ElementTree
+    parser = expat.ParserCreate(namespace_separator='}')
+    tags = []
+    name = []
+    # None until <name> is seen, then True while its text is read
+    state = {'name': None, 'metapackage': False, 'export_done': False}
+
+    def start(tag, attrs):
+        tags.append(tag)
+        depth = len(tags)
+        if depth == 2 and tag == 'name' and state['name'] is None:
+            state['name'] = True
+        elif depth == 3:
+            # findtext() only returns the text before the first child
+            if tags[1] == 'name':
+                state['name'] = False
+            elif tags[1] == 'export' and tag == 'metapackage':
+                state['metapackage'] = True
+                if state['name'] is False:
+                    raise _HeaderComplete()
+
+    def end(tag):
+        depth = len(tags)
+        tags.pop()
+        if depth == 2:
+            if tag == 'name' and state['name'] is True:
+                state['name'] = False
+            elif tag == 'export':
+                state['export_done'] = True
+            if state['name'] is False and (state['metapackage'] or state['export_done']):
+                raise _HeaderComplete()
+
+    def data(text):
+        if state['name'] is True and len(tags) == 2:
+            name.append(text)
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = data
+    try:
+        with open(filename, 'rb') as f:
+            parser.ParseFile(f)
+    except _HeaderComplete:
+        pass
+    except expat.ExpatError as e:
+        err = ParseError(str(e))
+        err.code = e.code
+        err.position = e.lineno, e.offset
+        raise err
+    if state['name'] is None:
+        return None, state['metapackage']
+    return ''.join(name), state['metapackage']
+
+
+def _visit_dir(d, mtimes=None, identities=None, hidden=None):
+    """
+    Examine a single directory during a crawl.  The result is
+    independent of the kind of resource being searched for, see
+    :func:`_classify`.
+
+    :param mtimes: see :func:`list_by_path`
+    :param identities: (optional) updated with the ``(st_dev,
+      st_ino)`` of *d*, see :class:`_DirClaims`
+    :param hidden: (optional) updated with the number of hidden
+      subdirectories of *d* that are skipped
+    :returns: (marker files, (package name, is metapackage) or
+      ``None``, child directories to crawl in listing order) or
+      ``None`` if *d* cannot be listed
+    """
+    if mtimes is not None or identities is not None:
+        # recorded before listing so that concurrent changes make
+        # the recorded value stale rather than the listing
+        try:
+            st = os.stat(d)
+        except OSError:
+            st = None
+        if mtimes is not None:
+            mtimes[d] = st.st_mtime_ns if st is not None else None
+        if identities is not None and st is not None:
+            identities[d] = st.st_dev, st.st_ino
+    listing = _scan_dir(d)
+    if listing is None:
+        return None
+    markers, subdirs, hidden_subdirs = listing
+    package = None
+    if PACKAGE_FILE in markers and CATKIN_IGNORE not in markers:
+        package_file = os.path.join(d, PACKAGE_FILE)
+        if mtimes is not None:
+            mtimes[package_file] = _get_mtime(package_file)
+        package_name, is_metapackage = _read_package_header(package_file)
+        if package_name is not None:
+            package_name = package_name.strip(' \n\r\t')
+        package = package_name, is_metapackage
+    if markers & _LEAF_MARKER_FILES:
+        return markers, package, []
+    # hidden dirs (esp. .svn/.git) are already removed by _scan_dir().
+    # stacks are descended into as they can contain packages.
+    if hidden is not None and hidden_subdirs:
+        hidden[d] = hidden_subdirs
+    return markers, package, [os.path.join(d, sd) for sd in subdirs]
+
+
+def _classify(manifest_name, d, visit):
+    """
+    Decide what a visited directory means for a crawl searching for
+    *manifest_name* resources.
+
+    :param visit: return value of :func:`_visit_dir`
+    :returns: (resource name or ``None``, ``True`` if the crawl
+      must not descend into *d*), ``(str, bool)``
+    """
+    if visit is None:
+        return None, True
+    markers, package, _ = visit
+    if CATKIN_IGNORE in markers:
+        return None, True
+    if package is not None:
+        # decide if package.xml matches the search criteria
+        is_metapackage = package[1]
+        if (
+            (manifest_name == STACK_FILE and is_metapackage) or
+            (manifest_name == MANIFEST_FILE and not is_metapackage) or
+            manifest_name == PACKAGE_FILE
+        ):
+            return package[0], True
+    if manifest_name in markers:
+        return os.path.basename(d), True
+    if MANIFEST_FILE in markers or PACKAGE_FILE in markers:
+        # noop if manifest_name==MANIFEST_FILE, but a good
+        # optimization for stacks.
+        return None, True
+    if NOSUBDIRS_FILE in markers:
+        return None, True
+    return None, False
+
+
+def _iter_visited(manifest_name, path, visit, aliases=None):
+    """
+    Generate the resources below *path* in the same order as
+    :func:`list_by_path` finds them, including duplicates.  Directories
+    are only visited as the generator is consumed.
+
+    :param visit: function returning the :func:`_visit_dir` result
+      for a directory
+    :param aliases: (optional) directories whose children are
+      recorded under another path, see :class:`_DirClaims`.  An alias
+      is descended into through that path unless this walk already
+      did, as a crawl for another kind of resource may have reached it
+      first within a directory this walk does not descend into, e.g.
+      a stack.  ``{str: str}``
+    :returns: iterator of (resource name, directory), ``(str, str)``
+    """
+    # (directory, directory its record is kept under), depth-first in
+    # listing order, which is the order of os.walk()
+    pending = [(path, path)]
+    # directories descended into, which aliases are not expanded to
+    entered = set()
+    while pending:
+        d, recorded = pending.pop()
+        if aliases:
+            owner = aliases.get(recorded)
+            if owner is not None and owner not in entered:
+                recorded = owner
+        v = visit(recorded)
+        resource_name, leaf = _classify(manifest_name, d, v)
+        if resource_name is not None:
+            yield resource_name, d
+        if not leaf:
+            entered.add(recorded)
+            # below an alias, resources are reported under the alias
+            pending.extend((os.path.join(d, os.path.basename(c)), c) for c in reversed(v[2]))
+
+
+def _list_visited(manifest_name, path, visit, cache, aliases=None):
+    """
+    Enumerate the resources below *path* in the same order as
+    :func:`list_by_path` would.
+
+    :param visit: function returning the :func:`_visit_dir` result
+      for a directory
+    :param aliases: see :func:`_iter_visited`
+    """
+    resources = []
+    found = set()
+    for resource_name, d in _iter_visited(manifest_name, path, visit, aliases):
+        if resource_name not in found:
+            # the first resource found within a path wins
+            found.add(resource_name)
+            resources.append(resource_name)
+            if cache is not None:
+                cache[resource_name] = d
+    return resources
+
+
+# where resources usually are relative to a ROS path, e.g. for a
+# source checkout, an install space and a catkin workspace
+_PROBED_SUBDIRS = ((), ('share',), ('src',))
+
+
+def _probe_resource(manifest_name, path, name, mtimes=None, identities=None):
+    """
+    Look for the resource *name* in the directories it is usually
+    found in below *path*, without listing *path*.  A directory is
+    only returned if a crawl of *path* reaches it, but a crawl may
+    find another resource of the same name first.
+
+    :param mtimes: see :func:`list_by_path`
+    :param identities: see :func:`_visit_dir`
+    :returns: (directory of the resource or ``None``, ``{dir:
+      _visit_dir() result}`` of the probed directories), ``(str, dict)``
+    """
+    visits = {}
+    if name.startswith('.') or os.sep in name:
+        return None, visits
+    # directories a crawl does not descend into
+    blockers = _LEAF_MARKER_FILES | set([manifest_name])
+    reachable = {}
+
+    def is_reachable(d):
+        if d not in reachable:
+            reachable[d] = os.path.isdir(d) and \
+                not any(os.path.exists(os.path.join(d, m)) for m in blockers)
+        return reachable[d]
+
+    for subdirs in _PROBED_SUBDIRS:
+        parent = path
+        ok = is_reachable(parent)
+        for subdir in subdirs:
+            parent = os.path.join(parent, subdir)
+            ok = ok and is_reachable(parent)
+        d = os.path.join(parent, name)
+        if not ok or not os.path.isdir(d):
+            continue
+        v = visits[d] = _visit_dir(d, mtimes, identities)
+        if _classify(manifest_name, d, v)[0] == name:
+            return d, visits
+    return None, visits
+
+
+def list_by_path(manifest_name, path, cache, mtimes=None):
     """
     List ROS stacks or packages within the specified path.
 
@@ -54,53 +391,1018 @@ def list_by_path(manifest_name, path, cache):
     mappings. list_by_path() does NOT returned cached results
     -- it only updates the cache.
 
+    Symlinks to directories are followed, but a directory reached
+    again through another path, e.g. a symlink cycle, is not
+    descended into again.
+
     :param manifest_name: MANIFEST_FILE or STACK_FILE, ``str``
     :param path: path to list resources in, ``str``
     :param cache: path cache to update. Maps resource name to directory path, ``{str: str}``
+    :param mtimes: (optional) updated with the modification time of
+      every directory that was listed and every ``package.xml`` that
+      was parsed. A *path* that does not exist is recorded as
+      ``None``. ``{str: int}``
     :returns: complete list of resources in ROS environment, ``[str]``
     """
-    resources = []
-    path = os.path.abspath(path)
-    basename = os.path.basename
-    for d, dirs, files in os.walk(path, topdown=True, followlinks=True):
-        if 'CATKIN_IGNORE' in files:
-            del dirs[:]
-            continue  # leaf
-        if PACKAGE_FILE in files:
-            # parse package.xml and decide if it matches the search criteria
-            root = ElementTree(None, os.path.join(d, PACKAGE_FILE))
-            is_metapackage = root.find('./export/metapackage') is not None
-            if (
-                (manifest_name == STACK_FILE and is_metapackage) or
-                (manifest_name == MANIFEST_FILE and not is_metapackage) or
-                manifest_name == PACKAGE_FILE
-            ):
-                resource_name = root.findtext('name').strip(' \n\r\t')
-                if resource_name not in resources:
-                    resources.append(resource_name)
-                    if cache is not None:
-                        cache[resource_name] = d
-                del dirs[:]
-                continue  # leaf
-        if manifest_name in files:
-            resource_name = basename(d)
-            if resource_name not in resources:
-                resources.append(resource_name)
-                if cache is not None:
-                    cache[resource_name] = d
-            del dirs[:]
-            continue  # leaf
-        elif MANIFEST_FILE in files or PACKAGE_FILE in files:
-            # noop if manifest_name==MANIFEST_FILE, but a good
-            # optimization for stacks.
-            del dirs[:]
-            continue  # leaf
-        elif 'rospack_nosubdirs' in files:
-            del dirs[:]
-            continue   # leaf
-        # remove hidden dirs (esp. .svn/.git)
-        [dirs.remove(di) for di in dirs if di[0] == '.']
-    return resources
+    claims = _DirClaims()
+
+    def visit(d):
+        return claims.claim(d, _visit_dir(d, mtimes, claims.identities))
+    return _list_visited(manifest_name, os.path.abspath(path), visit, cache)
+
+
+class _DirClaims(object):
+    """
+    Identities of the directories seen by a crawl.  Directories are
+    claimed in the order in which :func:`list_by_path` walks them, and
+    a directory reached again through another path, e.g. a symlink in
+    a symlink farm or a symlink cycle, is not descended into again.
+    The resources below it have already been found under the first
+    path, unless a listing does not descend into that path, see
+    :func:`_iter_visited`.
+    """
+
+    def __init__(self, identities=None):
+        """
+        :param identities: ``{dir: (st_dev, st_ino)}`` as recorded by
+          :func:`_visit_dir`
+        """
+        self.identities = identities if identities is not None else {}
+        # {(st_dev, st_ino): dir descended into}
+        self.owners = {}
+        # {dir: dir of the same identity that was descended into instead}
+        self.aliases = {}
+
+    def claim(self, d, visit):
+        """
+        :param visit: :func:`_visit_dir` result for *d*
+        :returns: *visit*, without child directories if the directory
+          has already been claimed under another path
+        """
+        identity = self.identities.get(d)
+        if visit is None or identity is None:
+            return visit
+        owner = self.owners.setdefault(identity, d)
+        if owner == d:
+            return visit
+        self.aliases[d] = owner
+        return visit[0], visit[1], []
+
+
+class CrawlStats(object):
+    """
+    Statistics about the crawl of a single ROS path.  Directories that
+    are below several ROS paths are counted for the first one crawled.
+    """
+    __slots__ = ['path', 'visited', 'unlistable', 'ignored', 'nosubdirs',
+                 'leaves', 'hidden', 'aliases', 'packages_parsed', 'seconds']
+
+    def __init__(self, path):
+        """
+        :param path: ROS path, ``str``
+        """
+        self.path = path
+        #: directories listed
+        self.visited = 0
+        #: directories that could not be listed
+        self.unlistable = 0
+        #: directories not descended into because of CATKIN_IGNORE
+        self.ignored = 0
+        #: directories not descended into because of rospack_nosubdirs
+        self.nosubdirs = 0
+        #: resource directories, which are not descended into
+        self.leaves = 0
+        #: hidden subdirectories skipped
+        self.hidden = 0
+        #: directories not descended into as they were already reached
+        #: through another path, e.g. a symlink
+        self.aliases = 0
+        #: package.xml files parsed
+        self.packages_parsed = 0
+        #: wall time spent crawling the path, in seconds
+        self.seconds = 0.0
+
+    def _add_visit(self, visit, hidden, is_alias):
+        self.visited += 1
+        if visit is None:
+            self.unlistable += 1
+            return
+        markers = visit[0]
+        if CATKIN_IGNORE in markers:
+            self.ignored += 1
+        elif MANIFEST_FILE in markers or PACKAGE_FILE in markers:
+            self.leaves += 1
+        elif NOSUBDIRS_FILE in markers:
+            self.nosubdirs += 1
+        if visit[1] is not None:
+            self.packages_parsed += 1
+        self.hidden += hidden
+        self.aliases += is_alias
+
+    def __str__(self):
+        return "%s: %d directories (%d unlistable, %d ignored, %d nosubdirs, %d leaves, " \
+            "%d hidden, %d aliases), %d package.xml parsed in %.3fs" % (
+                self.path, self.visited, self.unlistable, self.ignored, self.nosubdirs,
+                self.leaves, self.hidden, self.aliases, self.packages_parsed, self.seconds)
+
+    def __repr__(self):
+        return '<CrawlStats %s>' % self
+
+
+def _crawl(paths, visits, mtimes, claims, workers=None, stats=None):
+    """
+    Visit all directories below *paths* and store the
+    :func:`_visit_dir` results in *visits*.  Directories are claimed in
+    the order of :func:`list_by_path`, see :class:`_DirClaims`.  A
+    directory shared by several paths is only listed once.
+    Directories already in *visits* are not listed again, but their
+    children are crawled.
+
+    :param claims: :class:`_DirClaims` of the crawl
+    :param workers: If greater than one, list directories ahead of
+      the crawl in a pool of this many threads.  This pays off where
+      listing a directory is dominated by latency, e.g. on network
+      filesystems.
+    :param stats: (optional) updated with the :class:`CrawlStats` of
+      each path, ``{str: CrawlStats}``
+    """
+    identities = claims.identities
+    hidden = {} if stats is not None else None
+    prefetched = {}
+    executor = None
+    if workers and workers > 1:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        lock = Lock()
+        # only the first path to each directory is listed ahead, which
+        # bounds the work spent on symlink cycles
+        expanded = set()
+
+        def fetch(d):
+            # recorded separately and merged once the crawl reaches d
+            d_mtimes = {}
+            d_identities = {}
+            d_hidden = {} if hidden is not None else None
+            visit = _visit_dir(d, d_mtimes, d_identities, d_hidden)
+            identity = d_identities.get(d)
+            with lock:
+                if visit is not None and identity not in expanded:
+                    expanded.add(identity)
+                    for child in visit[2]:
+                        prefetch(child)
+            return visit, d_mtimes, d_identities, d_hidden
+
+        def prefetch(d):
+            # called with lock held
+            if d not in visits and d not in prefetched and executor is not None:
+                prefetched[d] = executor.submit(fetch, d)
+
+        with lock:
+            for path in paths:
+                prefetch(path)
+    try:
+        seen = set()
+        for path in paths:
+            start = time.time()
+            path_stats = None
+            if stats is not None:
+                path_stats = stats.setdefault(path, CrawlStats(path))
+            pending = [path]
+            while pending:
+                d = pending.pop()
+                if d in seen:
+                    continue
+                seen.add(d)
+                if d in visits:
+                    visit = visits[d]
+                else:
+                    future = None
+                    if executor is not None:
+                        with lock:
+                            future = prefetched.pop(d, None)
+                    if future is not None:
+                        visit, d_mtimes, d_identities, d_hidden = future.result()
+                        mtimes.update(d_mtimes)
+                        identities.update(d_identities)
+                        if d_hidden:
+                            hidden.update(d_hidden)
+                    else:
+                        visit = _visit_dir(d, mtimes, identities, hidden)
+                visit = visits[d] = claims.claim(d, visit)
+                if path_stats is not None:
+                    is_alias = d in claims.aliases
+                    path_stats._add_visit(visit, 0 if is_alias else hidden.pop(d, 0), is_alias)
+                if visit is not None:
+                    # depth-first in listing order, like list_by_path()
+                    pending.extend(reversed(visit[2]))
+            if path_stats is not None:
+                path_stats.seconds += time.time() - start
+    finally:
+        if executor is not None:
+            with lock:
+                pool, executor = executor, None
+                for future in prefetched.values():
+                    future.cancel()
+            pool.shutdown()
+
+
+def _get_racy(mtimes, start):
+    """
+    :param mtimes: see :func:`list_by_path`
+    :param start: time at which the paths were listed, in
+      nanoseconds, ``int``
+    :returns: paths modified so close to *start* that a later change
+      may not change their recorded modification time, e.g. on
+      filesystems with coarse timestamps, ``{str}``
+    """
+    return set(p for p, mtime in mtimes.items() if mtime is not None and mtime >= start - _RACY_MTIME_NS)
+
+
+class WorkspaceIndex(object):
+    """
+    Index of the packages, stacks and ``package.xml`` packages on a
+    set of ROS paths, built from a single crawl of each path.  Managers
+    for the same ROS paths share one index, see
+    :func:`get_workspace_index`.  The index records the modification
+    time of every directory it listed, which is used to detect that it
+    is out-of-date and to update it incrementally.
+    """
+
+    def __init__(self, ros_paths):
+        """
+        :param ros_paths: Ordered list of paths to index, ``[str]``
+        """
+        self._ros_paths = [os.path.abspath(p) for p in ros_paths]
+        # {dir: _visit_dir() result}, None until crawled
+        self._visits = None
+        self._mtimes = None
+        self._claims = None
+        # paths in _mtimes that are listed again by refresh() even if
+        # their modification time did not change, see _get_racy()
+        self._racy = set()
+        self._crawl_stats = None
+        self._persisted = False
+        # directories listed by find() before the index was built,
+        # which the crawl does not list again
+        self._found_visits = {}
+        self._found_mtimes = {}
+        self._found_identities = {}
+        self._found_start = None
+
+    def get_ros_paths(self):
+        return self._ros_paths[:]
+    ros_paths = property(get_ros_paths, doc="Get ROS paths of this index")
+
+    def is_built(self):
+        """
+        :returns: ``True`` if the ROS paths have been crawled, ``bool``
+        """
+        return self._visits is not None
+
+    def find(self, manifest_name, name):
+        """
+        Locate a single resource without crawling the ROS paths in
+        full, for an index that has not been built yet.  The ROS paths
+        are searched in order.  On each, the usual locations
+        ``<path>/<name>``, ``<path>/share/<name>`` and
+        ``<path>/src/<name>`` are checked first, then the path is
+        crawled until the resource is found.  The directories listed
+        are reused when the index is built.
+
+        If a resource is found more than once within a single ROS
+        path, the one returned may differ from the one the index
+        records.
+
+        :param manifest_name: MANIFEST_FILE, STACK_FILE or PACKAGE_FILE
+        :param name: resource name, ``str``
+        :returns: directory of the resource or ``None`` if it is not
+          on the ROS paths, ``str``
+        """
+        if self._found_start is None:
+            self._found_start = int(time.time() * 1e9)
+        visits = self._found_visits
+        mtimes = self._found_mtimes
+        # the listings are kept as they are, the crawl claims them again
+        claims = _DirClaims(self._found_identities)
+
+        def visit(d):
+            if d not in visits:
+                visits[d] = _visit_dir(d, mtimes, claims.identities)
+            return claims.claim(d, visits[d])
+
+        for path in self._ros_paths:
+            d, probed = _probe_resource(manifest_name, path, name, mtimes, claims.identities)
+            visits.update(probed)
+            if d is not None:
+                return d
+            for resource_name, d in _iter_visited(manifest_name, path, visit):
+                if resource_name == name:
+                    return d
+        return None
+
+    def is_current(self):
+        """
+        :returns: ``True`` if the index has been built and none of the
+          crawled directories changed since, ``bool``
+        """
+        if self._visits is None or self._racy:
+            return False
+        # any added or removed entry changes the mtime of the listed
+        # directory, so unchanged mtimes mean an unchanged crawl
+        for path, mtime in self._mtimes.items():
+            if _get_mtime(path) != mtime:
+                return False
+        return True
+
+    def update(self, crawl_workers=None, persistent=False, dirs=None):
+        """
+        Make sure the index reflects the filesystem.  The ROS paths are
+        crawled if the index has not been built yet, otherwise only
+        the directories that changed are listed again, see
+        :meth:`refresh`.
+
+        :param crawl_workers: see :func:`_crawl`
+        :param persistent: If ``True``, start from the index stored in
+          ROS home instead of crawling when possible, and store the
+          index there if it changed.
+        :param dirs: see :meth:`refresh`
+        """
+        start = int(time.time() * 1e9)
+        if self._found_start is not None:
+            start = self._found_start
+        if self._visits is None and not (persistent and self._load()):
+            self._build(crawl_workers)
+        elif self.refresh(crawl_workers, dirs):
+            self._persisted = False
+        self._found_visits, self._found_mtimes, self._found_identities = {}, {}, {}
+        self._found_start = None
+        if persistent and not self._persisted:
+            self._save(start)
+
+    def _build(self, crawl_workers):
+        """
+        Crawl the ROS paths, reusing the directories listed by
+        :meth:`find`.
+        """
+        start = int(time.time() * 1e9)
+        if self._found_start is not None:
+            start = min(start, self._found_start)
+        visits = self._found_visits
+        mtimes = self._found_mtimes
+        claims = _DirClaims(self._found_identities)
+        # the crawl strips listings of directories it does not
+        # descend into, so they can only be reused once
+        self._found_visits, self._found_mtimes, self._found_identities = {}, {}, {}
+        stats = {}
+        _crawl(self._ros_paths, visits, mtimes, claims, crawl_workers, stats)
+        self._visits, self._mtimes, self._claims = visits, mtimes, claims
+        self._racy = _get_racy(mtimes, start)
+        self._crawl_stats = [stats[path] for path in self._ros_paths]
+        self._persisted = False
+        for path_stats in self._crawl_stats:
+            _logger.debug('crawled %s', path_stats, extra={'crawl_stats': path_stats})
+
+    def get_crawl_stats(self):
+        """
+        :returns: :class:`CrawlStats` of each ROS path, in order, for
+          the last time the ROS paths were crawled in full, or ``None``
+          if they have not been crawled by this process, e.g. because
+          the index was loaded from ROS home, ``[CrawlStats]``
+        """
+        if self._crawl_stats is None:
+            return None
+        return self._crawl_stats[:]
+
+    def refresh(self, crawl_workers=None, dirs=None):
+        """
+        Bring the index up-to-date by listing again only the
+        directories whose modification time (or the modification time
+        of whose ``package.xml``) changed, or was so close to the time
+        they were listed that it may not reflect later changes.
+        Subdirectories that appeared are crawled and the records of
+        subdirectories that disappeared are dropped.  A directory that
+        fails to be listed again keeps its previous record and is
+        retried by the next refresh.
+
+        :param crawl_workers: see :func:`_crawl`
+        :param dirs: If set, only check these directories, e.g. the
+          ones a filesystem notification was received for, and the
+          directories listed too recently, ``[str]``
+        :returns: directories that were listed again, ``[str]``
+        """
+        if self._visits is None:
+            return []
+        if dirs is None:
+            candidates = list(self._mtimes.items())
+        else:
+            candidates = []
+            for d in dirs:
+                for path in (d, os.path.join(d, PACKAGE_FILE)):
+                    if path in self._mtimes:
+                        candidates.append((path, self._mtimes[path]))
+        changed = set()
+        for path, mtime in candidates:
+            if _get_mtime(path) != mtime:
+                changed.add(path)
+        # changes within the timestamp tick of the listing do not show
+        changed.update(self._racy)
+        # mtimes also holds package.xml files, which are not visited
+        changed = set(path if path in self._visits else os.path.dirname(path) for path in changed)
+        # parents sort before their subdirectories, so that directories
+        # dropped along with a changed parent are skipped
+        relisted = []
+        for d in sorted(changed):
+            if d not in self._visits:
+                continue
+            visits = {}
+            mtimes = {}
+            claims = _DirClaims()
+            start = int(time.time() * 1e9)
+            new = _visit_dir(d, mtimes, claims.identities)
+            identity = self._claims.identities.get(d)
+            if identity is not None and claims.identities.get(d) != identity:
+                # replaced by another directory, or a symlink changed
+                return self._rebuild(crawl_workers)
+            if d not in self._claims.aliases:
+                new = claims.claim(d, new)
+            elif new is not None:
+                new = new[0], new[1], []
+            visits[d] = new
+            children = new[2] if new is not None else []
+            _crawl([c for c in children if c not in self._visits], visits, mtimes, claims, crawl_workers)
+            old = self._visits[d]
+            keep = set(children)
+            dropped = self._get_subtrees([c for c in old[2] if c not in keep]) if old is not None else set()
+            if self._has_claim_conflict(claims, dropped):
+                return self._rebuild(crawl_workers)
+            # only modify the index once d has been listed successfully
+            self._drop(dropped)
+            self._mtimes.pop(os.path.join(d, PACKAGE_FILE), None)
+            self._racy.difference_update([d, os.path.join(d, PACKAGE_FILE)])
+            self._racy.update(_get_racy(mtimes, start))
+            self._visits.update(visits)
+            self._mtimes.update(mtimes)
+            self._claims.identities.update(claims.identities)
+            self._claims.owners.update(claims.owners)
+            self._claims.aliases.update(claims.aliases)
+            relisted.append(d)
+        return relisted
+
+    def _has_claim_conflict(self, claims, dropped):
+        """
+        :param claims: :class:`_DirClaims` of the directories about to
+          be added to the index
+        :param dropped: directories about to be dropped from the index
+        :returns: ``True`` if the change affects which path to a
+          directory is descended into, ``bool``
+        """
+        for identity, d in claims.owners.items():
+            if self._claims.owners.get(identity, d) != d:
+                return True
+        for alias, owner in self._claims.aliases.items():
+            if owner in dropped and alias not in dropped:
+                return True
+        return False
+
+    def _rebuild(self, crawl_workers):
+        """
+        Crawl the ROS paths again, for changes that :meth:`refresh`
+        cannot apply incrementally.
+
+        :returns: directories that were listed, ``[str]``
+        """
+        self._build(crawl_workers)
+        return sorted(self._visits)
+
+    def _get_subtrees(self, dirs):
+        """
+        :returns: *dirs* and their subdirectories in the index, ``{str}``
+        """
+        roots = set(self._ros_paths)
+        subtrees = set()
+        pending = list(dirs)
+        while pending:
+            d = pending.pop()
+            # a nested ROS path is indexed on its own behalf
+            if d in roots or d in subtrees:
+                continue
+            subtrees.add(d)
+            v = self._visits.get(d)
+            if v is not None:
+                pending.extend(v[2])
+        return subtrees
+
+    def _drop(self, dirs):
+        """
+        Drop the records of *dirs*.
+        """
+        claims = self._claims
+        for d in dirs:
+            self._mtimes.pop(d, None)
+            self._mtimes.pop(os.path.join(d, PACKAGE_FILE), None)
+            self._racy.difference_update([d, os.path.join(d, PACKAGE_FILE)])
+            self._visits.pop(d, None)
+            identity = claims.identities.pop(d, None)
+            if claims.aliases.pop(d, None) is None and claims.owners.get(identity) == d:
+                del claims.owners[identity]
+
+    def get_aliases(self):
+        """
+        :returns: new mapping of the directories that were not
+          descended into, as the crawl had already reached them through
+          another path (e.g. a symlink), to that path, ``{str: str}``
+        """
+        if self._claims is None:
+            return {}
+        return dict(self._claims.aliases)
+
+    def get_crawled_dirs(self):
+        """
+        :returns: new mapping of the directories recorded in the index
+          to ``False`` for those that could not be listed, e.g.
+          because they do not exist, ``{str: bool}``
+        """
+        if self._visits is None:
+            return {}
+        return dict((d, v is not None) for d, v in list(self._visits.items()))
+
+    def get_locations(self, manifest_name):
+        """
+        :param manifest_name: MANIFEST_FILE, STACK_FILE or PACKAGE_FILE
+        :returns: new mapping of resource name to directory path.  If
+          a resource is on several ROS paths, the first one wins. ``{str: str}``
+        """
+        cache = {}
+        for path in reversed(self._ros_paths):
+            _list_visited(manifest_name, path, self._visits.get, cache, self._claims.aliases)
+        return cache
+
+    def list_by_path(self, manifest_name, path):
+        """
+        Like :func:`list_by_path`, but served from the index if *path*
+        has been crawled.
+
+        :returns: resource names, ``[str]``
+        """
+        path = os.path.abspath(path)
+        if self._visits is None or path not in self._visits:
+            return list_by_path(manifest_name, path, None)
+        return _list_visited(manifest_name, path, self._visits.get, None, self._claims.aliases)
+
+    def _get_filename(self):
+        key = '\n'.join(self._ros_paths)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(get_ros_home(), 'rospkg_cache', 'workspace_%s.json' % digest)
+
+    def _load(self):
+        """
+        Load the index written by :meth:`_save`.  The loaded index may
+        be out-of-date, see :meth:`refresh`.
+
+        :returns: ``True`` on success, ``bool``
+        """
+        try:
+            with open(self._get_filename(), 'r') as f:
+                data = json.load(f)
+            if data['version'] != _WORKSPACE_INDEX_VERSION or data['ros_paths'] != self._ros_paths:
+                return False
+            join = os.path.join
+            visits = {}
+            for d, v in data['visits'].items():
+                if v is not None:
+                    markers, package, children = v
+                    v = (set(markers), tuple(package) if package else None, [join(d, c) for c in children])
+                visits[d] = v
+            identities = dict((d, tuple(identity)) for d, identity in data['identities'].items())
+            claims = _DirClaims(identities)
+            claims.aliases = data['aliases']
+            for d, identity in identities.items():
+                if visits.get(d) is not None and d not in claims.aliases:
+                    claims.owners[identity] = d
+            self._visits, self._mtimes, self._claims = visits, data['mtimes'], claims
+            self._racy = set()
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return False
+        self._persisted = True
+        return True
+
+    def _save(self, start):
+        """
+        Atomically write the index to ROS home.  Failures are silently
+        ignored as the index is only an optimization.
+
+        :param start: time at which the crawl started, in nanoseconds, ``int``
+        """
+        if _get_racy(self._mtimes, start):
+            return
+        visits = {}
+        for d, v in self._visits.items():
+            if v is not None:
+                markers, package, children = v
+                v = (sorted(markers), package, [os.path.basename(c) for c in children])
+            visits[d] = v
+        data = {
+            'version': _WORKSPACE_INDEX_VERSION,
+            'ros_paths': self._ros_paths,
+            'mtimes': self._mtimes,
+            'visits': visits,
+            'identities': self._claims.identities,
+            'aliases': self._claims.aliases,
+        }
+        filename = self._get_filename()
+        dirname = os.path.dirname(filename)
+        try:
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            fd, tmp_filename = tempfile.mkstemp(dir=dirname, prefix='.workspace')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f)
+                os.replace(tmp_filename, filename)
+            except Exception:
+                os.remove(tmp_filename)
+                raise
+        except (IOError, OSError):
+            return
+        self._persisted = True
+
+
+def _get_manifest_stamp(path, manifest_name):
+    """
+    :returns: modification times of the files a manifest of the
+      resource in *path* may be parsed from, ``(int, int)``
+    """
+    return _get_mtime(os.path.join(path, manifest_name)), _get_mtime(os.path.join(path, PACKAGE_FILE))
+
+
+_shared_lock = Lock()
+
+
+def _get_shared(registry, key, factory):
+    """
+    :param registry: ``{key: value}`` in order of last use
+    :returns: value of *key* in *registry*, created by calling
+      *factory* if there is none.  The least recently used values
+      beyond :data:`_SHARED_LIMIT` are dropped from *registry*, but
+      stay valid for those that hold them.
+    """
+    with _shared_lock:
+        value = registry.pop(key, None)
+        if value is None:
+            value = factory()
+        registry[key] = value
+        while len(registry) > _SHARED_LIMIT:
+            del registry[next(iter(registry))]
+        return value
+
+
+_workspace_indexes = {}
+
+
+def get_workspace_index(ros_paths):
+    """
+    Get the :class:`WorkspaceIndex` shared by all managers for
+    *ros_paths*.  The index may not have been built yet, see
+    :meth:`WorkspaceIndex.update`.  Only the indexes of the most
+    recently used sets of ROS paths are kept for later callers.
+
+    :param ros_paths: Ordered list of paths, ``[str]``
+    """
+    key = tuple(os.path.abspath(p) for p in ros_paths)
+    return _get_shared(_workspace_indexes, key, partial(WorkspaceIndex, key))
+
+
+def _stat_manifest(path, manifest_name):
+    """
+    :returns: file a manifest of the resource in *path* is parsed from
+      and its identity, i.e. size, modification time and inode, or
+      ``None`` if there is none, ``(str, (int, int, int))``
+    """
+    for filename in (os.path.join(path, manifest_name), os.path.join(path, PACKAGE_FILE)):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            return filename, (st.st_size, st.st_mtime_ns, st.st_ino)
+    return None
+
+
+def _parse_manifest_files(manifest_name, paths):
+    """
+    Parse the manifests of the resources in *paths*, e.g. in a worker
+    process of :meth:`ManifestManager.load_all_manifests`.
+
+    :returns: manifest or exception raised while parsing it, for each
+      path in order, ``[Manifest or Exception]``
+    """
+    results = []
+    for path in paths:
+        try:
+            results.append(parse_manifest_file(path, manifest_name, lazy=True))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def _parse_manifest_files_in_pool(manifest_name, paths, workers=None):
+    """
+    Like :func:`_parse_manifest_files`, but spread over *workers*
+    processes, in this process if ``None``.  Falls back to parsing in
+    this process if worker processes cannot be used.
+    """
+    workers = min(workers or 1, len(paths))
+    if workers <= 1:
+        return _parse_manifest_files(manifest_name, paths)
+    # a few chunks per worker, to balance the load at a low overhead
+    size = -(-len(paths) // (workers * 4))
+    chunks = [paths[i:i + size] for i in range(0, len(paths), size)]
+    results = []
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            for chunk_results in pool.map(partial(_parse_manifest_files, manifest_name), chunks):
+                results.extend(chunk_results)
+    except (OSError, NotImplementedError, BrokenProcessPool):
+        # e.g. no support for the semaphores of the pool
+        return _parse_manifest_files(manifest_name, paths)
+    return results
+
+
+class _ManifestStore(object):
+    """
+    Parsed manifests stored in ROS home, keyed by the identity of the
+    file they were parsed from, so that later processes only parse
+    the manifests that changed.  Entries are appended to a JSON lines
+    file as manifests are parsed, the last entry of a file wins.
+    Manifests with unknown tags are not stored, as these are kept as
+    DOM elements.  The dependencies of ``package.xml`` manifests are
+    classified with rosdep and the resources on the ROS paths, so
+    these are only stored if rosdep was available, and only served
+    while the rosdep database, ``ROS_DISTRO`` and the resources are
+    the same as when they were stored.
+    """
+
+    def __init__(self, ros_paths, manifest_name):
+        """
+        :param ros_paths: Ordered list of paths, ``[str]``
+        :param manifest_name: MANIFEST_FILE or STACK_FILE
+        """
+        self._ros_paths = list(ros_paths)
+        self._manifest_name = manifest_name
+        # {filename: (identity, _manifest_to_dict() result)}, None until loaded
+        self._entries = None
+        # {manager: (its locations, its generation, classification)},
+        # see _get_classification()
+        self._classifications = weakref.WeakKeyDictionary()
+        self._lock = Lock()
+
+    def _get_filename(self):
+        key = '\n'.join([self._manifest_name] + self._ros_paths)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(get_ros_home(), 'rospkg_cache', 'manifests_%s.jsonl' % digest)
+
+    def parse(self, path, rospack=None):
+        """
+        Like :func:`parse_manifest_file`, but served from the store
+        if the manifest file did not change since it was stored.
+
+        :raises: :exc:`InvalidManifest`, :exc:`IOError`
+        """
+        manifest, key = self.get(path, rospack=rospack)
+        if manifest is None:
+            manifest = parse_manifest_file(path, self._manifest_name, rospack=rospack)
+            self.put(key, manifest)
+        return manifest
+
+    def get(self, path, rospack=None):
+        """
+        :param path: directory of the resource, ``str``
+        :param rospack: manager the manifest is parsed with, see
+          :func:`parse_manifest_file`
+        :returns: stored manifest of the resource or ``None`` if it
+          has to be parsed, and the key to pass to :meth:`put` along
+          with the parsed manifest, ``(Manifest, object)``
+        """
+        start = int(time.time() * 1e9)
+        found = _stat_manifest(path, self._manifest_name)
+        if found is None:
+            return None, None
+        filename, identity = found
+        if os.path.basename(filename) == PACKAGE_FILE:
+            identity += (self._get_classification(rospack),)
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            entry = self._entries.get(filename)
+        if entry is not None and entry[0] == identity:
+            return _manifest_from_dict(entry[1]), None
+        return None, (filename, identity, start)
+
+    def put(self, key, manifest):
+        """
+        Store a manifest parsed after :meth:`get` did not find it.
+        """
+        if key is None:
+            return
+        filename, identity, start = key
+        # without rosdep no dependencies are classified at all
+        if os.path.basename(filename) == PACKAGE_FILE and not _has_rosdep_view():
+            return
+        data = _manifest_to_dict(manifest)
+        # a file modified while it was parsed may keep its identity
+        if data is not None and identity[1] < start - _RACY_MTIME_NS:
+            self._add(filename, identity, data)
+
+    def _get_classification(self, rospack):
+        """
+        :param rospack: :class:`ManifestManager` or ``None``
+        :returns: digest of what the dependencies of ``package.xml``
+          manifests parsed with *rospack* are classified with, ``str``
+        """
+        locations = generation = None
+        if rospack is not None:
+            rospack._update_location_cache()
+            # replaced or, by refresh(), updated along with the
+            # generation whenever the resources change
+            locations = rospack._location_cache
+            generation = rospack._generation
+            cached = self._classifications.get(rospack)
+            if cached is not None and cached[0] is locations and cached[1] == generation:
+                return cached[2]
+        # 'rosdep update' replaces the sources cache and its index
+        sources_cache = os.path.join(get_ros_home(), 'rosdep', 'sources.cache')
+        key = [os.environ.get('ROS_DISTRO', '')]
+        for filename in (sources_cache, os.path.join(sources_cache, 'index')):
+            try:
+                key.append(str(os.stat(filename).st_mtime_ns))
+            except OSError:
+                key.append('')
+        if locations is not None:
+            key.extend(sorted(locations))
+        classification = hashlib.sha1('\n'.join(key).encode('utf-8')).hexdigest()
+        if rospack is not None:
+            self._classifications[rospack] = (locations, generation, classification)
+        return classification
+
+    def _load(self):
+        """
+        :returns: entries of the store, which is rewritten without the
+          superseded entries if there are many, ``dict``
+        """
+        entries = {}
+        count = 0
+        try:
+            with open(self._get_filename(), 'r') as f:
+                for line in f:
+                    count += 1
+                    try:
+                        version, filename, identity, data = json.loads(line)
+                    except (ValueError, TypeError):
+                        # e.g. a line being appended by another process
+                        continue
+                    if version == _MANIFEST_STORE_VERSION:
+                        entries[filename] = (tuple(identity), data)
+        except (IOError, OSError):
+            return entries
+        if count - len(entries) > _MANIFEST_STORE_SLACK:
+            self._rewrite(entries)
+        return entries
+
+    def _encode(self, filename, identity, data):
+        return json.dumps([_MANIFEST_STORE_VERSION, filename, identity, data]) + '\n'
+
+    def _add(self, filename, identity, data):
+        """
+        Append an entry to the store.  Failures are silently ignored as
+        the store is only an optimization.
+        """
+        line = self._encode(filename, identity, data)
+        with self._lock:
+            self._entries[filename] = (identity, data)
+            filename = self._get_filename()
+            flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+            try:
+                try:
+                    fd = os.open(filename, flags, 0o666)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                    os.makedirs(os.path.dirname(filename))
+                    fd = os.open(filename, flags, 0o666)
+                # a single write, so that concurrent appends do not interleave
+                try:
+                    os.write(fd, line.encode('utf-8'))
+                finally:
+                    os.close(fd)
+            except (IOError, OSError):
+                pass
+
+    def _rewrite(self, entries):
+        """
+        Atomically replace the store with *entries*.  Entries appended
+        by other processes in the meantime may be lost.
+        """
+        store_filename = self._get_filename()
+        try:
+            fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(store_filename), prefix='.manifests')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    for filename, (identity, data) in entries.items():
+                        f.write(self._encode(filename, identity, data))
+                os.replace(tmp_filename, store_filename)
+            except Exception:
+                os.remove(tmp_filename)
+                raise
+        except (IOError, OSError):
+            pass
+
+
+_manifest_stores = {}
+
+
+def _get_manifest_store(ros_paths, manifest_name):
+    """
+    :returns: :class:`_ManifestStore` shared by all managers for
+      *ros_paths* and *manifest_name*
+    """
+    key = (manifest_name,) + tuple(os.path.abspath(p) for p in ros_paths)
+    return _get_shared(_manifest_stores, key, partial(_ManifestStore, key[1:], manifest_name))
+
+
+def _get_reachable(graph, names):
+    """
+    :param graph: ``{name: [name]}`` adjacency lists
+    :returns: *names* and all names reachable from them in *graph*, ``{str}``
+    """
+    reachable = set(names)
+    pending = list(reachable)
+    while pending:
+        for n in graph.get(pending.pop(), ()):
+            if n not in reachable:
+                reachable.add(n)
+                pending.append(n)
+    return reachable
+
+
+def _get_union(lists):
+    """
+    :returns: items of all *lists*, without duplicates, in order of
+      first appearance, ``list``
+    """
+    seen = set()
+    union = []
+    for items in lists:
+        for item in items:
+            if item not in seen:
+                seen.add(item)
+                union.append(item)
+    return union
+
+
+def _iter_components(root, get_edges, is_done):
+    """
+    Find the strongly connected components reachable from *root* with
+    an iterative version of Tarjan's algorithm, so that long chains do
+    not hit the recursion limit.
+
+    :param get_edges: function returning the names a name has edges
+      to, which is called once per name
+    :param is_done: function returning ``True`` for names whose
+      components were already handled, which are not visited
+    :returns: iterator of components, ``[str]``, each yielded after
+      all components it has edges to
+    """
+    index = {root: 0}
+    low = {root: 0}
+    stack = [root]
+    on_stack = set(stack)
+    work = [(root, iter(get_edges(root)))]
+    while work:
+        node, edges = work[-1]
+        for n in edges:
+            if n not in index:
+                if is_done(n):
+                    continue
+                index[n] = low[n] = len(index)
+                stack.append(n)
+                on_stack.add(n)
+                work.append((n, iter(get_edges(n))))
+                break
+            if n in on_stack:
+                low[node] = min(low[node], index[n])
+        else:
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    n = stack.pop()
+                    on_stack.discard(n)
+                    component.append(n)
+                    if n == node:
+                        break
+                yield component
 
 
 class ManifestManager(object):
@@ -109,10 +1411,12 @@ class ManifestManager(object):
     :class:`RosStack`.  This class indexes resources on paths with
     where manifests denote the precense of the resource.  NOTE: for
     performance reasons, instances cache information and will not
-    reflect changes made on disk or to environment configuration.
+    reflect changes made on disk or to environment configuration
+    until :meth:`refresh` is called.
     """
 
-    def __init__(self, manifest_name, ros_paths=None):
+    def __init__(self, manifest_name, ros_paths=None, persistent_index=False, crawl_workers=None,
+                 persistent_manifests=False):
         """
         ctor. subclasses are expected to use *manifest_name*
         to customize behavior of ManifestManager.
@@ -120,19 +1424,51 @@ class ManifestManager(object):
         :param manifest_name: MANIFEST_FILE or STACK_FILE
         :param ros_paths: Ordered list of paths to search for
           resources. If `None` (default), use environment ROS path.
+        :param persistent_index: If ``True``, store the resource
+          locations in ROS home and reuse them in later processes as
+          long as none of the crawled directories has changed.
+        :param crawl_workers: If greater than one, list directories
+          with this many threads when crawling the ROS paths.  Useful
+          on network filesystems where listings are latency-bound.
+        :param persistent_manifests: If ``True``, store parsed
+          manifests in ROS home and reuse them in later processes as
+          long as the manifest file has not changed, see
+          :class:`_ManifestStore`.
         """
         self._manifest_name = manifest_name
+        self._persistent_index = persistent_index
+        self._crawl_workers = crawl_workers
 
         if ros_paths is None:
             self._ros_paths = get_ros_paths()
         else:
             self._ros_paths = ros_paths
+        self._manifest_store = None
+        if persistent_manifests:
+            self._manifest_store = _get_manifest_store(self._ros_paths, manifest_name)
 
         self._manifests = {}
         self._depends_cache = {}
         self._rosdeps_cache = {}
+        # see _get_reverse_depends()
+        self._reverse_depends = None
+        self._dependency_graph = None
+        # see _get_path_trie()
+        self._path_trie = None
+        # see _get_export_index()
+        self._export_index = None
         self._location_cache = None
+        # see get_workspace_index()
+        self._workspace_index = None
+        # {name: path} of the resources located by _find()
+        self._found_locations = {}
         self._custom_cache = {}
+        # {name: _get_manifest_stamp()} of the loaded manifests
+        self._manifest_stamps = {}
+        # incremented whenever cached information is discarded, so that
+        # information derived concurrently with a refresh() is not
+        # cached, see _invalidate()
+        self._generation = 0
 
     @classmethod
     def get_instance(cls, ros_paths=None):
@@ -161,14 +1497,40 @@ class ManifestManager(object):
         return self._ros_paths[:]
     ros_paths = property(get_ros_paths, doc="Get ROS paths of this instance")
 
+    def get_workspace_index(self):
+        """
+        :returns: :class:`WorkspaceIndex` shared by all managers on the
+          ROS paths of this instance
+        """
+        # kept, as get_workspace_index() only keeps recently used ones
+        if self._workspace_index is None:
+            self._workspace_index = get_workspace_index(self._ros_paths)
+        return self._workspace_index
+
+    def get_crawl_stats(self):
+        """
+        Get statistics about the crawl of the ROS paths that located
+        the resources.  Each crawl is also logged to the
+        ``rospkg.rospack`` logger at ``DEBUG`` level, with the
+        :class:`CrawlStats` in the ``crawl_stats`` attribute of the
+        log record.
+
+        :returns: :class:`CrawlStats` of each ROS path, in order, or
+          ``None`` if the ROS paths have not been crawled in full by
+          this process, ``[CrawlStats]``
+        """
+        if not self._ros_paths:
+            return None
+        return self.get_workspace_index().get_crawl_stats()
+
     def get_manifest(self, name):
         """
         :raises: :exc:`InvalidManifest`
         """
-        if name in self._manifests:
-            return self._manifests[name]
-        else:
-            return self._load_manifest(name)
+        manifest = self._manifests.get(name)
+        if manifest is not None:
+            return manifest
+        return self._load_manifest(name)
 
     def _update_location_cache(self):
         global _cache_lock
@@ -178,14 +1540,48 @@ class ManifestManager(object):
             if self._location_cache is not None:
                 return
             # initialize cache
-            cache = self._location_cache = {}
+            self._location_cache = {}
+            found = self._found_locations
+            self._found_locations = {}
             # nothing to search, #3680
             if not self._ros_paths:
                 return
-            # crawl paths using our own logic, in reverse order to get
-            # correct precedence
-            for path in reversed(self._ros_paths):
-                list_by_path(self._manifest_name, path, cache)
+            # crawl paths using our own logic.  The index is shared
+            # with other managers on the same paths and only crawled
+            # again when it is out-of-date.
+            index = self.get_workspace_index()
+            index.update(self._crawl_workers, self._persistent_index)
+            locations = index.get_locations(self._manifest_name)
+            # _find() may have located another resource of the same
+            # name than the crawl, which takes precedence from now on
+            self._invalidate([name for name, path in found.items() if locations.get(name) != path])
+            self._location_cache = locations
+
+    def _find(self, name):
+        """
+        Locate the resource *name* without locating all resources, as
+        long as the ROS paths have not been crawled.  Resources are
+        located in full when needed, e.g. by :meth:`list`.  If a ROS
+        path holds the resource more than once, the crawl may locate
+        another one, in which case cached information about the
+        resource is discarded when the ROS paths are crawled.
+
+        :returns: directory of the resource or ``None`` if it was not
+          found or the ROS paths have already been crawled, ``str``
+        """
+        with _cache_lock:
+            if self._location_cache is not None or not self._ros_paths:
+                return None
+            index = self.get_workspace_index()
+            if index.is_built() or self._persistent_index:
+                # refreshing the index is cheaper than probing
+                return None
+            path = self._found_locations.get(name)
+            if path is None:
+                path = index.find(self._manifest_name, name)
+                if path is not None:
+                    self._found_locations[name] = path
+            return path
 
     def list(self):
         """
@@ -202,23 +1598,229 @@ class ManifestManager(object):
         :returns: filesystem path of package
         :raises: :exc:`ResourceNotFound`
         """
+        if self._location_cache is None:
+            path = self._find(name)
+            if path is not None:
+                return path
         self._update_location_cache()
-        if name not in self._location_cache:
+        # a single lookup, as a Watcher may update the cache concurrently
+        path = self._location_cache.get(name)
+        if path is None:
             raise ResourceNotFound(name, ros_paths=self._ros_paths)
-        else:
-            return self._location_cache[name]
+        return path
 
     def _load_manifest(self, name):
         """
         :raises: :exc:`ResourceNotFound`
         """
-        retval = self._manifests[name] = parse_manifest_file(self.get_path(name), self._manifest_name, rospack=self)
+        generation = self._generation
+        path = self.get_path(name)
+        # taken before parsing, so that concurrent edits are detected by refresh()
+        stamp = _get_manifest_stamp(path, self._manifest_name)
+        retval = self._parse_manifest(path)
+        with _cache_lock:
+            if self._generation == generation:
+                self._manifests[name] = retval
+                self._manifest_stamps[name] = stamp
         return retval
 
+    def load_all_manifests(self, names=None, workers=None):
+        """
+        Parse the manifests of many resources at once and add them to
+        the cache of :meth:`get_manifest`.  Manifests that are already
+        cached are not parsed again.  A resource that fails to load
+        does not prevent the others from loading.
+
+        Manifests are parsed in this process unless *workers* is
+        greater than ``1``, in which case ``manifest.xml`` and
+        ``stack.xml`` files are parsed by a pool of worker processes.
+        ``package.xml`` files are always parsed in this process, as
+        their dependencies are classified with rosdep and this
+        instance.  Worker processes may import the ``__main__`` module
+        of the program, so a script that passes *workers* has to guard
+        its entry point with ``if __name__ == '__main__':``.
+
+        :param names: resource names, all resources if ``None``, ``[str]``
+        :param workers: number of worker processes, ``None`` or ``1``
+          to parse in this process, ``int``
+        :returns: manifest of each resource that was loaded, and
+          exception raised while locating or parsing the manifest of
+          each other resource, ``({str: Manifest}, {str: Exception})``
+        """
+        generation = self._generation
+        if names is None:
+            names = self.list()
+        store = self._manifest_store
+        manifests = {}
+        errors = {}
+        # {name: _get_manifest_stamp()} of the manifests parsed here
+        stamps = {}
+        # (name, path, stamp, store key) of the manifests parsed by the pool
+        jobs = []
+        for name in names:
+            manifest = self._manifests.get(name)
+            if manifest is not None:
+                manifests[name] = manifest
+                continue
+            try:
+                path = self.get_path(name)
+                # taken before parsing, see _load_manifest()
+                stamp = _get_manifest_stamp(path, self._manifest_name)
+                key = None
+                if store is not None:
+                    manifest, key = store.get(path, rospack=self)
+                if manifest is None:
+                    found = _stat_manifest(path, self._manifest_name) if key is None else key
+                    if found is not None and os.path.basename(found[0]) == self._manifest_name:
+                        jobs.append((name, path, stamp, key))
+                        continue
+                    manifest = parse_manifest_file(path, self._manifest_name, rospack=self)
+                    if store is not None:
+                        store.put(key, manifest)
+            except Exception as e:
+                errors[name] = e
+                continue
+            manifests[name] = manifest
+            stamps[name] = stamp
+        if jobs:
+            results = _parse_manifest_files_in_pool(self._manifest_name, [job[1] for job in jobs], workers)
+            for (name, path, stamp, key), result in zip(jobs, results):
+                if isinstance(result, Exception):
+                    errors[name] = result
+                    continue
+                if store is not None:
+                    store.put(key, result)
+                manifests[name] = result
+                stamps[name] = stamp
+        with _cache_lock:
+            if self._generation == generation:
+                for name, stamp in stamps.items():
+                    self._manifests[name] = manifests[name]
+                    self._manifest_stamps[name] = stamp
+        return manifests, errors
+
+    def _parse_manifest(self, path):
+        """
+        Parse the manifest of a resource lazily, as most manifests are
+        only loaded for their dependencies and exports.
+
+        :param path: directory of the resource, ``str``
+        :raises: :exc:`InvalidManifest`, :exc:`IOError`
+        """
+        if self._manifest_store is not None:
+            return self._manifest_store.parse(path, rospack=self)
+        return parse_manifest_file(path, self._manifest_name, rospack=self, lazy=True)
+
+    def _read_manifest(self, name):
+        """
+        Like :meth:`get_manifest`, but a manifest that is not cached yet
+        is not added to the cache, for reading all manifests once
+        without keeping them in memory.
+
+        :raises: :exc:`InvalidManifest`, :exc:`ResourceNotFound`
+        """
+        manifest = self._manifests.get(name)
+        if manifest is not None:
+            return manifest
+        return self._parse_manifest(self.get_path(name))
+
+    def refresh(self, dirs=None):
+        """
+        Update this instance with changes made on disk since resources
+        were located.  Only directories whose modification time
+        changed are listed again.  Cached manifests and dependency
+        information are discarded for resources that were added,
+        removed or moved or whose manifest changed, and for resources
+        whose cached dependencies include one of them.
+
+        :param dirs: If set, only check these directories for changes,
+          e.g. the ones a filesystem notification was received for,
+          ``[str]``
+        :returns: names of resources that were added, removed or moved
+          or whose manifest changed, ``[str]``
+        """
+        with _cache_lock:
+            if not self._ros_paths or (self._location_cache is None and not self._found_locations):
+                # nothing has been cached yet
+                return []
+            index = self.get_workspace_index()
+            index.update(self._crawl_workers, self._persistent_index, dirs)
+            locations = index.get_locations(self._manifest_name)
+            if self._location_cache is not None:
+                old_locations = self._location_cache
+                names = set(old_locations) | set(locations)
+            else:
+                # only single resources have been located, see _find()
+                old_locations = self._found_locations
+                names = set(old_locations)
+                self._location_cache = {}
+            self._found_locations = {}
+            affected = set([name for name in names if old_locations.get(name) != locations.get(name)])
+            if dirs is not None:
+                dirs = set(os.path.abspath(d) for d in dirs)
+            for name, stamp in list(self._manifest_stamps.items()):
+                if name not in locations or (dirs is not None and locations[name] not in dirs):
+                    continue
+                if _get_manifest_stamp(locations[name], self._manifest_name) != stamp:
+                    affected.add(name)
+            # update in place, as callers may hold a reference
+            location_cache = self._location_cache
+            for name in set(location_cache) - set(locations):
+                del location_cache[name]
+            location_cache.update(locations)
+            self._invalidate(affected)
+            if dirs:
+                # a manifest in dirs that was not cached yet may be
+                # being loaded from before the change
+                self._generation += 1
+            return sorted(affected)
+
+    def watch(self, interval=1.0):
+        """
+        Keep this instance up-to-date with changes made on disk from a
+        background thread, see :class:`rospkg.watcher.Watcher`.  Can be
+        used as a context manager.
+
+        :param interval: see :class:`rospkg.watcher.Watcher`
+        :returns: started :class:`rospkg.watcher.Watcher`
+        """
+        from .watcher import Watcher
+        watcher = Watcher(self, interval)
+        watcher.start()
+        return watcher
+
+    def _invalidate(self, names):
+        """
+        Discard cached information about the resources *names* and
+        about resources whose cached dependencies include them.  Called
+        with ``_cache_lock`` held, which is also held while information
+        is cached, so that information derived from the discarded one
+        is not cached.
+        """
+        names = set(names)
+        if names:
+            self._generation += 1
+            self._reverse_depends = None
+            self._dependency_graph = None
+            self._path_trie = None
+            self._export_index = None
+        stale = set(names)
+        for name, depends in list(self._depends_cache.items()):
+            if not names.isdisjoint(depends):
+                stale.add(name)
+        for name in names:
+            self._manifests.pop(name, None)
+            self._manifest_stamps.pop(name, None)
+        for name in stale:
+            self._depends_cache.pop(name, None)
+            self._rosdeps_cache.pop(name, None)
+
     def get_depends(self, name, implicit=True):
         """
         Get dependencies of a resource.  If implicit is ``True``, this
-        includes implicit (recursive) dependencies.
+        includes implicit (recursive) dependencies.  Resources that
+        depend on each other have the same implicit dependencies, which
+        include themselves.
 
         :param name: resource name, ``str``
         :param implicit: include implicit (recursive) dependencies, ``bool``
@@ -231,23 +1833,236 @@ class ManifestManager(object):
             m = self.get_manifest(name)
             return [d.name for d in m.depends]
         else:
-            if name in self._depends_cache:
-                return self._depends_cache[name]
+            return self._compute_depends([name])[name]
 
-            # take the union of all dependencies
-            names = [p.name for p in self.get_manifest(name).depends]
+    def get_depends_many(self, names, implicit=True):
+        """
+        Get dependencies of several resources at once.  Implicit
+        dependencies are computed in a single traversal of the
+        dependency graph, which loads each manifest once.
 
-            # assign key before recursive call to prevent infinite case
-            self._depends_cache[name] = s = set()
+        :param names: resource names, ``[str]``
+        :param implicit: include implicit (recursive) dependencies, ``bool``
 
-            for p in names:
-                s.update(self.get_depends(p, implicit))
-            # add in our own deps
-            s.update(names)
-            # cache the return value as a list
-            s = list(s)
-            self._depends_cache[name] = s
-            return s
+        :returns: dependencies of each resource, like
+          :meth:`get_depends`, and their union, in order of first
+          appearance, ``({str: [str]}, [str])``
+        :raises: :exc:`InvalidManifest` If any resource or any of
+          their dependencies have an invalid manifest.
+        """
+        if implicit:
+            depends = self._compute_depends(names)
+        else:
+            depends = dict((name, self.get_depends(name, False)) for name in names)
+        return depends, _get_union(depends[name] for name in names)
+
+    def iter_depends(self, name, max_depth=None, prune=None, predicate=None, order='bfs'):
+        """
+        Iterate over the dependencies of a resource, loading manifests
+        only as the iteration proceeds, so that stopping early does not
+        compute the full implicit dependencies.  Without arguments, the
+        same dependencies as :meth:`get_depends` are yielded.
+
+        :param name: resource name, ``str``
+        :param max_depth: If set, only yield dependencies reachable
+          through at most this many direct dependencies, e.g. ``1``
+          for the explicit ones, ``int``
+        :param prune: If set, function called with the name of each
+          dependency, which is not descended into if it returns
+          ``True``, e.g. for resources of an underlay
+        :param predicate: If set, function called with the name of
+          each dependency, which is only yielded if it returns
+          ``True``.  Dependencies are descended into either way.
+        :param order: ``'bfs'`` to yield dependencies by increasing
+          depth, or ``'dfs'`` to descend into each dependency before
+          its siblings, ``str``
+        :returns: iterator of names of dependencies, each yielded once
+        :raises: :exc:`InvalidManifest`, :exc:`ResourceNotFound` When
+          the manifest of a dependency to descend into cannot be loaded
+        :raises: :exc:`ValueError` If *order* is invalid
+        """
+        if order not in ('bfs', 'dfs'):
+            raise ValueError("invalid order %r, expected 'bfs' or 'dfs'" % order)
+        # {name: smallest depth it was reached at}
+        depths = {name: 0}
+        seen = set()
+        pending = deque([(name, 0)])
+        while pending:
+            n, depth = pending.popleft() if order == 'bfs' else pending.pop()
+            if depth > depths[n]:
+                # reached again through a shorter path in the meantime
+                continue
+            if depth:
+                if n not in seen:
+                    seen.add(n)
+                    if predicate is None or predicate(n):
+                        yield n
+                if prune is not None and prune(n):
+                    continue
+            if max_depth is not None and depth >= max_depth:
+                continue
+            depends = self.get_depends(n, implicit=False)
+            if order == 'dfs':
+                # the first dependency is popped first
+                depends = reversed(depends)
+            for p in depends:
+                if p == name:
+                    # a cycle, the resource is one of its own dependencies
+                    if p not in seen:
+                        seen.add(p)
+                        if predicate is None or predicate(p):
+                            yield p
+                    continue
+                if p in depths and depths[p] <= depth + 1:
+                    continue
+                depths[p] = depth + 1
+                pending.append((p, depth + 1))
+
+    def _compute_depends(self, names):
+        """
+        Compute the implicit dependencies of *names* and of all their
+        dependencies that are not cached yet.  Resources that depend
+        on each other share a single list of dependencies, which
+        includes themselves.  Only complete results are cached, so
+        nothing is cached for a resource whose dependencies cannot be
+        loaded.
+
+        :returns: implicit dependencies of *names*, ``{str: [str]}``
+        :raises: :exc:`InvalidManifest`, :exc:`ResourceNotFound`
+        """
+        generation = self._generation
+        cache = self._depends_cache
+        direct = {}
+        # results do not depend on the cache, which a Watcher may clear
+        depends = {}
+        computed = {}
+
+        def get_edges(n):
+            direct[n] = [p.name for p in self.get_manifest(n).depends]
+            return direct[n]
+
+        def is_done(n):
+            if n not in depends and n in cache:
+                depends[n] = cache[n]
+            return n in depends
+        try:
+            for name in names:
+                if is_done(name):
+                    continue
+                for component in _iter_components(name, get_edges, is_done):
+                    # take the union of all dependencies of the component
+                    s = set()
+                    for n in component:
+                        s.update(direct[n])
+                        for p in direct[n]:
+                            if p in depends:
+                                s.update(depends[p])
+                    # cache the return value as a list
+                    s = list(s)
+                    for n in component:
+                        depends[n] = computed[n] = s
+        finally:
+            # complete components are cached even if a later one fails
+            with _cache_lock:
+                if self._generation == generation:
+                    cache.update(computed)
+        return dict((name, depends[name]) for name in names)
+
+    def get_affected(self, paths, implicit=True):
+        """
+        Get the resources affected by changes to files, e.g. for
+        deciding what to rebuild and test.  Each path is attributed to
+        the resource whose directory contains it, and the resources
+        that depend on those are added.  Unlike :meth:`get_depends_on`,
+        resources with an invalid or missing implicit dependency are
+        included, only resources with an invalid manifest are not.
+
+        Paths are normalized lexically before they are matched, so a
+        ``..`` that follows a symlink is applied to the symlink rather
+        than to its target, unlike :class:`PackageResolver`.
+
+        :param paths: paths of changed files or directories, relative
+          to the current directory or absolute, ``iterable of str``
+        :param implicit: include resources that depend on the changed
+          ones implicitly (recursively), ``bool``
+        :returns: names of affected resources, in order of
+          precedence, ``[str]``
+        """
+        trie = self._get_path_trie()
+        cwd = os.getcwd()
+        owners = set()
+        # {directory as given: (trie node, name of enclosing resource)},
+        # as changed files are usually next to each other
+        dir_nodes = {}
+        for path in paths:
+            d, base = os.path.split(path)
+            if base in ('', os.curdir, os.pardir):
+                d, base = os.path.split(os.path.normpath(os.path.join(cwd, path)))
+            if d in dir_nodes:
+                node, owner = dir_nodes[d]
+            else:
+                node, owner = trie, None
+                for part in os.path.normpath(os.path.join(cwd, d)).split(os.sep):
+                    node = node.get(part)
+                    if node is None:
+                        break
+                    owner = node.get(None, owner)
+                dir_nodes[d] = node, owner
+            if node is not None:
+                owner = node.get(base, {}).get(None, owner)
+            if owner is not None:
+                owners.add(owner)
+        reverse, _, order, _ = self._get_reverse_depends()
+        if implicit:
+            affected = _get_reachable(reverse, owners)
+        else:
+            affected = set(owners)
+            for name in owners:
+                affected.update(reverse.get(name, []))
+        return sorted(affected, key=order.get)
+
+    def _get_path_trie(self):
+        """
+        :returns: trie of the directories of all resources, with the
+          name of the resource under the ``None`` key of its node,
+          ``dict``
+        """
+        trie = self._path_trie
+        if trie is not None:
+            return trie
+        generation = self._generation
+        trie = {}
+        self._update_location_cache()
+        for name, path in list(self._location_cache.items()):
+            # also match paths with symlinks resolved, e.g. from git
+            for p in set([os.path.abspath(path), os.path.realpath(path)]):
+                node = trie
+                for part in p.split(os.sep):
+                    node = node.setdefault(part, {})
+                node.setdefault(None, name)
+        with _cache_lock:
+            if self._generation == generation:
+                self._path_trie = trie
+        return trie
+
+    def get_dependency_graph(self):
+        """
+        Get the dependency graph of all resources, for answering many
+        dependency queries quickly.  The graph is built on the first
+        call and built again after a :meth:`refresh` that found
+        changes.
+
+        :returns: :class:`rospkg.graph.DependencyGraph`
+        """
+        graph = self._dependency_graph
+        if graph is None:
+            from .graph import DependencyGraph
+            generation = self._generation
+            graph = DependencyGraph(self)
+            with _cache_lock:
+                if self._generation == generation:
+                    self._dependency_graph = graph
+        return graph
 
     def get_depends_on(self, name, implicit=True):
         """
@@ -255,50 +2070,129 @@ class ManifestManager(object):
         includes implicit (recursive) dependency relationships.
 
         NOTE: this does *not* raise :exc:`rospkg.InvalidManifest` if
-        there are invalid manifests found.
+        there are invalid manifests found.  Resources with an invalid
+        manifest are skipped, and so are resources with an invalid or
+        missing implicit dependency if implicit is ``True``.
 
         :param name: resource name, ``str``
         :param implicit: include implicit (recursive) dependencies, ``bool``
 
         :returns: list of names of dependencies, ``[str]``
         """
-        depends_on = []
+        reverse, broken, order, closures = self._get_reverse_depends()
         if not implicit:
-            # have to examine all dependencies
-            for r in self.list():
-                if r == name:
-                    continue
-                try:
-                    m = self.get_manifest(r)
-                    if any(d for d in m.depends if d.name == name):
-                        depends_on.append(r)
-                except InvalidManifest:
-                    # robust to bad packages
-                    pass
-                except ResourceNotFound:
-                    # robust to bad packages
-                    pass
-        else:
-            # Computing implicit dependencies requires examining the
-            # dependencies of all packages.  As we already implement
-            # this logic in get_depends(), we simply reuse it here for
-            # the reverse calculation.  This enables us to use the
-            # same dependency cache that get_depends() uses.  The
-            # efficiency is roughly the same due to the caching.
-            for r in self.list():
-                if r == name:
-                    continue
-                try:
-                    depends = self.get_depends(r, implicit=True)
-                    if name in depends:
-                        depends_on.append(r)
-                except InvalidManifest:
-                    # robust to bad packages
-                    pass
-                except ResourceNotFound:
-                    # robust to bad packages
-                    pass
-        return depends_on
+            return [r for r in reverse.get(name, []) if r != name]
+        if name not in closures:
+            depends_on = _get_reachable(reverse, [name])
+            depends_on.discard(name)
+            closures[name] = sorted(depends_on - broken, key=order.get)
+        return list(closures[name])
+
+    def _get_reverse_depends(self):
+        """
+        Index the direct dependencies of all resources in reverse, once
+        for all calls of :meth:`get_depends_on`.
+
+        :returns: (``{name: [names of resources that depend on it
+          directly]}``, names of resources whose implicit dependencies
+          cannot be computed, ``{name: position in list()}``, ``{name:
+          [names of resources that depend on it implicitly]}`` filled
+          in by :meth:`get_depends_on`), ``({str: [str]}, {str}, {str:
+          int}, {str: [str]})``
+        """
+        if self._reverse_depends is not None:
+            return self._reverse_depends
+        generation = self._generation
+        resources = self.list()
+        reverse = {}
+        bad = set()
+        for r in resources:
+            try:
+                m = self.get_manifest(r)
+            except InvalidManifest:
+                # robust to bad packages
+                bad.add(r)
+                continue
+            except ResourceNotFound:
+                # robust to bad packages
+                bad.add(r)
+                continue
+            for d in m.depends:
+                dependents = reverse.setdefault(d.name, [])
+                # lists stay in list() order, without duplicates
+                if not dependents or dependents[-1] != r:
+                    dependents.append(r)
+        order = dict((r, i) for i, r in enumerate(resources))
+        # missing dependencies, which get_depends() cannot locate
+        bad.update(d for d in reverse if d not in order)
+        # get_depends() raises for resources that depend on a bad one
+        broken = _get_reachable(reverse, bad)
+        reverse_depends = reverse, broken, order, {}
+        with _cache_lock:
+            if self._generation == generation:
+                self._reverse_depends = reverse_depends
+        return reverse_depends
+
+    def find_exports(self, tag, attr):
+        """
+        Find the exports of all resources with a tag and attribute,
+        e.g. ``find_exports('nodelet', 'plugin')``, like calling
+        :meth:`Manifest.get_export` on the manifest of every resource.
+        The exports of all resources are indexed once for all calls,
+        until resources change, see :meth:`refresh`.
+
+        NOTE: this does *not* raise :exc:`rospkg.InvalidManifest` if
+        there are invalid manifests found.  Resources with an invalid
+        manifest are skipped.
+
+        :param tag: Name of XML tag of the export, ``str``
+        :param attr: Name of XML attribute to retrieve from tag, ``str``
+        :returns: name of the resource and value of the attribute, with
+          ``${prefix}`` replaced by the directory of the resource, for
+          each export, in :meth:`list` order, ``[(str, str)]``
+        """
+        index, results = self._get_export_index()
+        key = (tag, attr)
+        if key not in results:
+            values = []
+            for name, prefix, attrs in index.get(tag, []):
+                value = attrs.get(attr)
+                if value is not None:
+                    values.append((name, value.replace('${prefix}', prefix)))
+            results[key] = values
+        return list(results[key])
+
+    def _get_export_index(self):
+        """
+        Index the exports of all resources by tag, once for all calls
+        of :meth:`find_exports`.  All manifests are loaded in this
+        process, see :meth:`load_all_manifests`.
+
+        :returns: (``{tag: [(name, prefix, attributes)]}``, ``{(tag,
+          attr): [(name, value)]}`` filled in by
+          :meth:`find_exports`), ``({str: [(str, str, {str: str})]},
+          {(str, str): [(str, str)]})``
+        """
+        if self._export_index is not None:
+            return self._export_index
+        generation = self._generation
+        resources = self.list()
+        # robust to bad packages, which are left out.  Library code
+        # must not spawn worker processes behind the caller's back.
+        manifests, _ = self.load_all_manifests(resources, workers=1)
+        index = {}
+        for r in resources:
+            m = manifests.get(r)
+            if m is None:
+                continue
+            prefix = os.path.dirname(m.filename)
+            for e in m.exports:
+                index.setdefault(e.tag, []).append((r, prefix, e.attrs))
+        export_index = index, {}
+        with _cache_lock:
+            if self._generation == generation:
+                self._export_index = export_index
+        return export_index
 
     def get_custom_cache(self, key, default=None):
         return self._custom_cache.get(key, default)
@@ -316,7 +2210,11 @@ class RosPack(ManifestManager):
     NOTE 1: for performance reasons, RosPack caches information about
     packages.
 
-    NOTE 2: RosPack is not thread-safe.
+    NOTE 2: RosPack is not thread-safe, except that :meth:`refresh`
+    may run concurrently with queries, e.g. in the background thread
+    started by :meth:`watch`.  A query answered during a refresh may
+    not reflect it yet, but nothing derived from outdated information
+    is cached.
 
     Example::
       from rospkg import RosPack
@@ -327,13 +2225,21 @@ class RosPack(ManifestManager):
       direct_depends = rp.get_depends('roscpp', implicit=False)
     """
 
-    def __init__(self, ros_paths=None):
+    def __init__(self, ros_paths=None, persistent_index=False, crawl_workers=None,
+                 persistent_manifests=False):
         """
         :param ros_paths: Ordered list of paths to search for
           resources. If `None` (default), use environment ROS path.
+        :param persistent_index: If ``True``, reuse package locations
+          stored in ROS home by earlier processes while they are
+          up-to-date.
+        :param crawl_workers: If greater than one, crawl the ROS paths
+          with this many threads.
+        :param persistent_manifests: If ``True``, reuse manifests
+          parsed by earlier processes while their files are unchanged.
         """
         super(RosPack, self).__init__(MANIFEST_FILE,
-                                      ros_paths)
+                                      ros_paths, persistent_index, crawl_workers, persistent_manifests)
         self._rosdeps_cache = {}
 
     def get_rosdeps(self, package, implicit=True):
@@ -359,23 +2265,52 @@ class RosPack(ManifestManager):
         :param package: package name, ``str``
         :returns: list of rosdeps, ``[str]``
         """
-        if package in self._rosdeps_cache:
-            return self._rosdeps_cache[package]
+        return self.get_rosdeps_many([package])[0][package]
 
-        # set the key before recursive call to prevent infinite case
-        self._rosdeps_cache[package] = s = set()
+    def get_rosdeps_many(self, packages, implicit=True):
+        """
+        Collect rosdeps of several packages at once.  Implicit rosdeps
+        are computed in a single traversal of the dependency graph,
+        which loads each manifest once.
+
+        :param packages: package names, ``[str]``
+        :param implicit: include implicit (recursive) rosdeps, ``bool``
 
-        # take the union of all dependencies
-        packages = self.get_depends(package, implicit=True)
-        for p in packages:
-            s.update(self.get_rosdeps(p, implicit=False))
-        # add in our own deps
-        m = self.get_manifest(package)
-        s.update([d.name for d in m.rosdeps])
-        # cache the return value as a list
-        s = list(s)
-        self._rosdeps_cache[package] = s
-        return s
+        :returns: rosdeps of each package, like :meth:`get_rosdeps`,
+          and their union, in order of first appearance, ``({str:
+          [str]}, [str])``
+        """
+        rosdeps = {}
+        if not implicit:
+            for package in packages:
+                rosdeps[package] = self.get_rosdeps(package, implicit=False)
+            return rosdeps, _get_union(rosdeps[p] for p in packages)
+
+        generation = self._generation
+        pending = []
+        for package in packages:
+            s = self._rosdeps_cache.get(package)
+            if s is None:
+                pending.append(package)
+            else:
+                rosdeps[package] = s
+        depends = self._compute_depends(pending)
+        direct = {}
+        for package in pending:
+            if package in rosdeps:
+                continue
+            # take the union of all dependencies and our own deps
+            s = set()
+            for p in depends[package] + [package]:
+                if p not in direct:
+                    direct[p] = self.get_rosdeps(p, implicit=False)
+                s.update(direct[p])
+            # cache the return value as a list
+            rosdeps[package] = list(s)
+        with _cache_lock:
+            if self._generation == generation:
+                self._rosdeps_cache.update((p, rosdeps[p]) for p in pending)
+        return rosdeps, _get_union(rosdeps[p] for p in packages)
 
     def stack_of(self, package):
         """
@@ -401,22 +2336,34 @@ class RosStack(ManifestManager):
     NOTE 1: for performance reasons, RosStack caches information about
     stacks.
 
-    NOTE 2: RosStack is not thread-safe.
+    NOTE 2: RosStack is not thread-safe, except that :meth:`refresh`
+    may run concurrently with queries, e.g. in the background thread
+    started by :meth:`watch`.  A query answered during a refresh may
+    not reflect it yet, but nothing derived from outdated information
+    is cached.
     """
 
-    def __init__(self, ros_paths=None):
+    def __init__(self, ros_paths=None, persistent_index=False, crawl_workers=None,
+                 persistent_manifests=False):
         """
         :param ros_paths: Ordered list of paths to search for
           resources. If `None` (default), use environment ROS path.
+        :param persistent_index: If ``True``, reuse stack locations
+          stored in ROS home by earlier processes while they are
+          up-to-date.
+        :param crawl_workers: If greater than one, crawl the ROS paths
+          with this many threads.
+        :param persistent_manifests: If ``True``, reuse manifests
+          parsed by earlier processes while their files are unchanged.
         """
-        super(RosStack, self).__init__(STACK_FILE, ros_paths)
+        super(RosStack, self).__init__(STACK_FILE, ros_paths, persistent_index, crawl_workers, persistent_manifests)
 
     def packages_of(self, stack):
         """
         :returns: name of packages that are part of stack, ``[str]``
         :raises: :exc:`ResourceNotFound` If stack cannot be located
         """
-        return list_by_path(MANIFEST_FILE, self.get_path(stack), {})
+        return self.get_workspace_index().list_by_path(MANIFEST_FILE, self.get_path(stack))
 
     def get_stack_version(self, stack):
         """
@@ -525,7 +2472,142 @@ def get_package_name(path):
     if os.path.exists(os.path.join(path, MANIFEST_FILE)):
         return os.path.basename(os.path.abspath(path))
     elif os.path.exists(os.path.join(path, PACKAGE_FILE)):
-        root = ElementTree(None, os.path.join(path, PACKAGE_FILE))
-        return root.findtext('name')
+        return _read_package_header(os.path.join(path, PACKAGE_FILE))[0]
     else:
         return None
+
+
+class PackageResolver(object):
+    """
+    Attribute many paths to the ROS packages that contain them, like
+    :func:`get_package_name`.  Each directory is listed at most once,
+    which tells both whether it is a package and which of its entries
+    are directories or symlinks, and each ``package.xml`` is read at
+    most once.  Symlinks are resolved, so a checkout reached through a
+    symlink is attributed like its target.  The results do not reflect
+    changes made on disk after a directory was listed.
+    """
+
+    def __init__(self):
+        self._cwd = os.getcwd()
+        # {directory as given: (resolved directory, names of entries
+        # that are directories or symlinks, name of enclosing package)}
+        self._dirs = {}
+        # {absolute directory: resolved directory}
+        self._reals = {}
+        # {resolved directory: (name of package or None if it is not
+        # one, names of entries that are directories or symlinks)}
+        self._listings = {}
+        # {resolved directory: name of enclosing package or None}
+        self._names = {}
+
+    def resolve(self, path):
+        """
+        :param path: filesystem path, relative to the current directory
+          at construction or absolute
+        :return: Package name or ``None`` if package cannot be found, ``str``
+        """
+        # files in the same directory are usually passed together
+        d, sep, base = path.rpartition(os.sep)
+        if base in ('', os.curdir, os.pardir):
+            return self._get_name(self._get_real(os.path.join(self._cwd, path)))
+        if sep and not d:
+            d = os.sep
+        entry = self._dirs.get(d)
+        if entry is None:
+            real = self._get_real(os.path.join(self._cwd, d))
+            entry = self._dirs[d] = real, self._list(real)[1], self._get_name(real)
+        if base in entry[1]:
+            # the path itself may be a package, or lead elsewhere
+            return self._get_name(self._get_child(entry[0], base))
+        return entry[2]
+
+    def resolve_many(self, paths):
+        """
+        :param paths: filesystem paths, ``iterable of str``
+        :return: package name or ``None`` for each path, in order, ``[str]``
+        """
+        return [self.resolve(path) for path in paths]
+
+    def _get_real(self, d):
+        """
+        Resolve *d* one component at a time, like
+        :func:`os.path.realpath`, so that ``..`` applies to the target
+        of a symlink rather than to the symlink.
+
+        :param d: absolute directory
+        :returns: *d* with symlinks resolved, ``str``
+        """
+        real = self._reals.get(d)
+        if real is None:
+            parent, base = os.path.split(d)
+            if parent == d:
+                real = d
+            elif base in ('', os.curdir):
+                real = self._get_real(parent)
+            elif base == os.pardir:
+                real = os.path.dirname(self._get_real(parent))
+            else:
+                real = self._get_child(self._get_real(parent), base)
+            self._reals[d] = real
+        return real
+
+    def _get_child(self, real, base):
+        path = os.path.join(real, base)
+        if base in self._list(real)[1] and os.path.islink(path):
+            return os.path.realpath(path)
+        return path
+
+    def _list(self, real):
+        """
+        :returns: see ``self._listings``
+        """
+        listing = self._listings.get(real)
+        if listing is not None:
+            return listing
+        markers = set()
+        special = set()
+        try:
+            entries = os.scandir(real)
+        except OSError:
+            entries = None
+        if entries is not None:
+            with entries:
+                for entry in entries:
+                    if entry.name in (MANIFEST_FILE, PACKAGE_FILE):
+                        markers.add(entry.name)
+                    try:
+                        if entry.is_symlink() or entry.is_dir(follow_symlinks=False):
+                            special.add(entry.name)
+                    except OSError:
+                        pass
+        name = None
+        if MANIFEST_FILE in markers:
+            name = os.path.basename(real)
+        elif PACKAGE_FILE in markers:
+            name = _read_package_header(os.path.join(real, PACKAGE_FILE))[0]
+        listing = self._listings[real] = (name, special)
+        return listing
+
+    def _get_name(self, real):
+        """
+        :param real: resolved path
+        :returns: name of the package that contains *real*, ``str``
+        """
+        # collect unresolved ancestors up to a known or a package directory
+        pending = []
+        name = None
+        while real not in self._names:
+            pending.append(real)
+            name = self._list(real)[0]
+            if name is not None:
+                break
+            parent = os.path.dirname(real)
+            if parent == real:
+                break
+            real = parent
+        else:
+            name = self._names[real]
+        for p in pending:
+            self._names[p] = name
+        return name
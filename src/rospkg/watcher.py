@@ -0,0 +1,350 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2011, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Keep a :class:`rospkg.RosPack` or :class:`rospkg.RosStack` up-to-date
+with changes made on disk, for long-running processes.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+
+from .rospack import _MARKER_FILES
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# changes of listings, of marker files and of watched directories themselves
+_WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_CLOSE_WRITE | \
+    IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class _Inotify(object):
+    """
+    Minimal ctypes binding of the Linux inotify API.
+    """
+
+    def __init__(self):
+        """
+        :raises: :exc:`OSError` If inotify is not available
+        """
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+            init = libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+
+    def _raise(self, path=None):
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code), path)
+
+    def add_watch(self, path, mask):
+        """
+        :returns: watch descriptor, which is the same for all paths of
+          a directory, ``int``
+        :raises: :exc:`OSError`
+        """
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            self._raise(path)
+        return wd
+
+    def rm_watch(self, wd):
+        # fails if the watch was already removed by the kernel
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """
+        :returns: pending events, ``[(int, int, str)]`` of (watch
+          descriptor, mask, name)
+        """
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return events
+                raise
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(buf, offset)
+                offset += _EVENT_HEADER.size
+                name = buf[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher(object):
+    """
+    Keep a :class:`rospkg.RosPack` or :class:`rospkg.RosStack` up-to-date
+    from a background thread.  On Linux, the directories crawled by the
+    manager are watched with inotify and only the directories that an
+    event was received for are checked again, so lookups stay served
+    from the location cache.  Elsewhere, or if inotify watches cannot
+    be set up (e.g. the limit on the number of watches is reached),
+    the whole manager is refreshed every *interval* seconds instead.
+
+    Example::
+
+        rp = RosPack()
+        with rp.watch():
+            path = rp.get_path('rospy')
+    """
+
+    def __init__(self, manager, interval=1.0, use_inotify=True):
+        """
+        :param manager: :class:`rospkg.RosPack` or :class:`rospkg.RosStack`
+        :param interval: seconds between refreshes when polling, and
+          between retries after a refresh failed, ``float``
+        :param use_inotify: If ``False``, always poll.
+        """
+        self._manager = manager
+        self._interval = interval
+        self._use_inotify = use_inotify
+        self._thread = None
+        self._stopping = threading.Event()
+        self._wake_fds = None
+        self._inotify = None
+        # {wd: {path watched by wd}}, {path: wd}
+        self._wd_paths = {}
+        self._path_wd = {}
+        # {path: {crawled directory whose changes are reported on path}}
+        self._watched = {}
+        #: last exception raised while refreshing, if any
+        self.last_error = None
+
+    def is_inotify(self):
+        """
+        :returns: ``True`` if changes are received through inotify
+          rather than polled for, ``bool``
+        """
+        return self._inotify is not None
+
+    def start(self):
+        """
+        Crawl the ROS paths of the manager if needed and start watching
+        them.  Has no effect if the watcher is already running.
+        """
+        if self._thread is not None:
+            return
+        # lookups are served right away, without waiting for the thread
+        self._manager.list()
+        self._stopping.clear()
+        if self._use_inotify:
+            try:
+                self._inotify = _Inotify()
+            except OSError:
+                self._inotify = None
+        self._wake_fds = os.pipe()
+        self._thread = threading.Thread(target=self._run, name='rospkg-watcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop watching and wait for the background thread to exit.
+        """
+        if self._thread is None:
+            return
+        self._stopping.set()
+        os.write(self._wake_fds[1], b'x')
+        self._thread.join()
+        self._thread = None
+        for fd in self._wake_fds:
+            os.close(fd)
+        self._wake_fds = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        self._wd_paths, self._path_wd, self._watched = {}, {}, {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _refresh(self, dirs=None):
+        """
+        :returns: ``True`` on success, ``bool``
+        """
+        try:
+            self._manager.refresh(dirs)
+        except Exception as e:
+            # e.g. a package.xml that is still being written
+            self.last_error = e
+            return False
+        return True
+
+    def _run(self):
+        if self._inotify is not None:
+            try:
+                added = self._sync_watches()
+            except OSError:
+                # e.g. ENOSPC, out of watches
+                self._inotify.close()
+                self._inotify = None
+                self._wd_paths, self._path_wd, self._watched = {}, {}, {}
+        if self._inotify is None:
+            while not self._stopping.wait(self._interval):
+                self._refresh()
+            return
+        ok = True
+        wake_fd = self._wake_fds[0]
+        while not self._stopping.is_set():
+            # changes made before a watch was added are only noticed by
+            # checking the directory, which may in turn add watches
+            while ok and added:
+                ok = self._refresh(added)
+                added = self._sync_watches_or_poll()
+                if added is None:
+                    ok, added = False, set()
+            timeout = None if ok else self._interval
+            select.select([self._inotify.fd, wake_fd], [], [], timeout)
+            if self._stopping.is_set():
+                return
+            dirs = set()
+            full = not ok
+            for wd, mask, name in self._inotify.read_events():
+                if mask & IN_Q_OVERFLOW:
+                    full = True
+                    continue
+                watched = set()
+                for path in self._wd_paths.get(wd, ()):
+                    watched.update(self._watched.get(path, ()))
+                if mask & IN_IGNORED:
+                    # the directory was removed or replaced
+                    self._forget(wd)
+                elif name and not mask & IN_ISDIR and name not in _MARKER_FILES:
+                    continue
+                dirs.update(watched)
+            if full:
+                # after an error, retry every interval until it succeeds
+                ok = self._refresh()
+            elif dirs:
+                ok = self._refresh(dirs)
+            added = self._sync_watches_or_poll()
+            if added is None:
+                ok, added = False, set()
+
+    def _sync_watches_or_poll(self):
+        """
+        :returns: see :meth:`_sync_watches` or ``None`` if a watch
+          could not be added, in which case changes are polled for
+          until watches can be added again
+        """
+        try:
+            return self._sync_watches()
+        except OSError as e:
+            self.last_error = e
+            return None
+
+    def _sync_watches(self):
+        """
+        Watch the directories in the index of the manager.  A directory
+        that could not be listed is watched through its nearest
+        existing ancestor, so that its creation is noticed.
+
+        :returns: crawled directories that are watched through a newly
+          added watch, ``{str}``
+        :raises: :exc:`OSError` If a watch cannot be added, e.g. the
+          limit on the number of watches is reached
+        """
+        watched = {}
+        index = self._manager.get_workspace_index()
+        for d, listable in index.get_crawled_dirs().items():
+            path = d
+            if not listable:
+                while not os.path.isdir(path) and os.path.dirname(path) != path:
+                    path = os.path.dirname(path)
+            watched.setdefault(path, set()).add(d)
+        self._watched = watched
+        added = set()
+        for path in watched:
+            if path in self._path_wd:
+                continue
+            try:
+                wd = self._inotify.add_watch(path, _WATCH_MASK)
+            except OSError as e:
+                if e.errno in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                    # removed in the meantime or unreadable, the
+                    # parent directory is watched
+                    continue
+                raise
+            self._path_wd[path] = wd
+            self._wd_paths.setdefault(wd, set()).add(path)
+            added.update(watched[path])
+        for path in [p for p in self._path_wd if p not in watched]:
+            wd = self._path_wd.pop(path)
+            paths = self._wd_paths[wd]
+            paths.discard(path)
+            if not paths:
+                del self._wd_paths[wd]
+                self._inotify.rm_watch(wd)
+        return added
+
+    def _forget(self, wd):
+        for path in self._wd_paths.pop(wd, ()):
+            self._path_wd.pop(path, None)
@@ -0,0 +1,261 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2011, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import tempfile
+import time
+
+
+def _age_tree(path, seconds=60):
+    # move mtimes out of the window in which directories are considered
+    # to be still changing
+    t = time.time() - seconds
+    for d, dirs, files in os.walk(path):
+        for f in files:
+            os.utime(os.path.join(d, f), (t, t))
+        os.utime(d, (t, t))
+
+
+def _make_workspace(root, manifests):
+    for name, text in manifests.items():
+        os.makedirs(os.path.join(root, name))
+        if text is None:
+            text = '<package><depend'
+        else:
+            text = '<package>%s</package>' % ''.join(
+                '<depend package="%s"/>' % d for d in text.split())
+        with open(os.path.join(root, name, 'manifest.xml'), 'w') as f:
+            f.write(text)
+
+
+def test_DependencyGraph():
+    from rospkg import InvalidManifest, ResourceNotFound, RosPack
+
+    tmp = tempfile.mkdtemp()
+    try:
+        _make_workspace(tmp, {
+            'a': '',
+            'b': 'a',
+            'c': 'b d',
+            'd': 'a',
+            'e': 'f',
+            'f': 'e c',
+            'g': 'missing',
+            'h': None,
+            'i': 'h',
+        })
+        _age_tree(tmp)
+        r = RosPack(ros_paths=[tmp])
+        graph = r.get_dependency_graph()
+        assert graph is r.get_dependency_graph()
+        for name in 'abcdef':
+            assert sorted(r.get_depends(name)) == sorted(graph.closure(name)), name
+        assert graph.depends('c', 'a')
+        assert not graph.depends('a', 'c')
+        assert not graph.depends('a', 'unknown')
+        # a cycle includes its members
+        assert graph.depends('e', 'e')
+        assert ['a', 'b', 'c', 'd', 'e', 'f'] == sorted(graph.closure('f'))
+        assert ['a'] == graph.common_dependencies('b', 'd')
+        assert ['a', 'b', 'd'] == sorted(graph.common_dependencies('c', 'e'))
+        assert [] == graph.common_dependencies('a', 'b')
+
+        # only queries that involve invalid resources raise
+        for name, error in (('g', ResourceNotFound), ('h', InvalidManifest), ('i', InvalidManifest),
+                            ('unknown', ResourceNotFound)):
+            try:
+                graph.closure(name)
+                assert False, 'should have raised'
+            except error:
+                pass
+        try:
+            graph.depends('i', 'a')
+            assert False, 'should have raised'
+        except InvalidManifest:
+            pass
+
+        # the graph is built again after changes
+        with open(os.path.join(tmp, 'a', 'manifest.xml'), 'w') as f:
+            f.write('<package><depend package="g"/></package>')
+        _age_tree(os.path.join(tmp, 'a'), 30)
+        assert ['a'] == r.refresh()
+        assert graph is not r.get_dependency_graph()
+        try:
+            r.get_dependency_graph().closure('b')
+            assert False, 'should have raised'
+        except ResourceNotFound:
+            pass
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_DependencyGraph_waves():
+    from rospkg import RosPack
+    from rospkg.graph import CyclicDependency
+
+    tmp = tempfile.mkdtemp()
+    try:
+        _make_workspace(tmp, {
+            'a': '',
+            'b': 'a',
+            'c': 'x',
+            'd': 'b c',
+            'e': '',
+            'x': 'a',
+            'y': 'z',
+            'z': 'y',
+        })
+        r = RosPack(ros_paths=[tmp])
+        graph = r.get_dependency_graph()
+        waves = graph.waves(['a', 'b', 'c', 'd', 'e', 'x'])
+        assert [['a', 'e'], ['b', 'x'], ['c'], ['d']] == [sorted(w) for w in waves]
+        # waves are in order of precedence
+        for wave in waves:
+            assert [p for p in r.list() if p in wave] == wave
+        assert [p for w in waves for p in w] == graph.topological_order(['e', 'd', 'c', 'x', 'b', 'a'])
+        # orderings through unselected packages are kept
+        assert [['a'], ['b', 'c'], ['d']] == [sorted(w) for w in graph.waves(['a', 'b', 'c', 'd'])]
+        assert [] == graph.waves([])
+
+        assert (4, ['a', 'x', 'c', 'd']) == graph.critical_path(['a', 'b', 'c', 'd', 'x'])
+        assert (12.5, ['a', 'b', 'd']) == graph.critical_path(
+            ['a', 'b', 'c', 'd', 'x'], weights={'a': 2, 'b': 10, 'd': 0.5})
+        assert (0, []) == graph.critical_path([])
+
+        # a single member of a cycle can be ordered, but not both
+        assert [['y']] == graph.waves(['y'])
+        try:
+            graph.topological_order()
+            assert False, 'should have raised'
+        except CyclicDependency as e:
+            assert ['y', 'z'] == sorted(e.names)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_DependencyGraph_why():
+    from rospkg import InvalidManifest, ResourceNotFound, RosPack
+
+    tmp = tempfile.mkdtemp()
+    try:
+        _make_workspace(tmp, {
+            'a': 'b c',
+            'b': 'd',
+            'c': 'e d',
+            'd': 'f',
+            'e': 'f a',
+            'f': '',
+            'g': None,
+        })
+        graph = RosPack(ros_paths=[tmp]).get_dependency_graph()
+        paths = graph.why('a', 'f', k=10)
+        assert [['a', 'b', 'd', 'f'], ['a', 'c', 'd', 'f'], ['a', 'c', 'e', 'f']] == sorted(paths)
+        assert paths[:1] == graph.why('a', 'f')
+        assert [['b', 'd']] == graph.why('b', 'd', k=2)
+        # cycles through a
+        assert [['a', 'c', 'e', 'a']] == graph.why('a', 'a', k=3)
+        assert [['c', 'd'], ['c', 'e', 'a', 'b', 'd']] == graph.why('c', 'd', k=3)
+        assert [] == graph.why('f', 'a')
+        assert [] == graph.why('a', 'g')
+        assert [] == graph.why('a', 'unknown')
+        for name, error in (('g', InvalidManifest), ('unknown', ResourceNotFound)):
+            try:
+                graph.why(name, 'a')
+                assert False, 'should have raised'
+            except error:
+                pass
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_export_graph():
+    import io
+    import json
+    import xml.etree.ElementTree as ElementTree
+    from rospkg import RosPack
+    from rospkg.graph import export_graph
+
+    tmp = tempfile.mkdtemp()
+    try:
+        _make_workspace(tmp, {
+            'a': 'b missing',
+            'b': '',
+            'c': None,
+        })
+        with open(os.path.join(tmp, 'b', 'manifest.xml'), 'w') as f:
+            f.write('<package><rosdep name="boost"/><depend package="a"/></package>')
+        r = RosPack(ros_paths=[tmp])
+
+        f = io.StringIO()
+        export_graph(r, f, 'jsonl')
+        records = [json.loads(line) for line in f.getvalue().splitlines()]
+        nodes = [(x['id'], x['name'], x['type']) for x in records if x['kind'] == 'node']
+        edges = [(x['source'], x['target'], x['type']) for x in records if x['kind'] == 'edge']
+        assert sorted(nodes) == [
+            ('a', 'a', 'package'), ('b', 'b', 'package'), ('c', 'c', 'package'),
+            ('missing', 'missing', 'package'), ('rosdep:boost', 'boost', 'rosdep')]
+        assert sorted(edges) == [
+            ('a', 'b', 'depend'), ('a', 'missing', 'depend'),
+            ('b', 'a', 'depend'), ('b', 'rosdep:boost', 'rosdep')]
+        # nodes come before their edges
+        ids = set()
+        for x in records:
+            if x['kind'] == 'node':
+                ids.add(x['id'])
+            else:
+                assert x['source'] in ids and x['target'] in ids
+        # manifests are not kept in memory
+        assert {} == r._manifests
+
+        f = io.StringIO()
+        export_graph(r, f, 'graphml')
+        ns = '{http://graphml.graphdrawing.org/xmlns}'
+        graph = ElementTree.fromstring(f.getvalue()).find(ns + 'graph')
+        assert sorted(n[0] for n in nodes) == sorted(n.get('id') for n in graph.findall(ns + 'node'))
+        assert sorted(edges) == sorted(
+            (e.get('source'), e.get('target'), e.find(ns + 'data').text) for e in graph.findall(ns + 'edge'))
+
+        f = io.StringIO()
+        export_graph(r, f)
+        dot = f.getvalue()
+        assert dot.startswith('digraph dependencies {\n') and dot.endswith('}\n')
+        assert '  "b" -> "rosdep:boost" [type="rosdep"];\n' in dot
+        assert '  "rosdep:boost" [label="boost", type="rosdep"];\n' in dot
+
+        try:
+            export_graph(r, f, 'svg')
+            assert False, 'should have raised'
+        except ValueError:
+            pass
+    finally:
+        shutil.rmtree(tmp)
@@ -214,6 +214,82 @@ def test_parse_bad_file():
             assert p in str(e), "file name [%s] should be in error message [%s]" % (p, str(e))
 
 
+def test_parse_manifest_markup():
+    from rospkg.manifest import parse_manifest, InvalidManifest, MANIFEST_FILE, STACK_FILE
+    m = parse_manifest(MANIFEST_FILE, """<package xmlns:x="http://x">
+  <description brief="b">Some <b x:a="1">bold</b> &amp; <![CDATA[raw]]><!--c--></description>
+  <license url="http://l">BSD<![CDATA[ignored]]></license>
+  <author>A</author><author> B </author>
+  <export><cpp cflags="-I${prefix}"/><python path="${prefix}/src">txt<!--c-->more</python></export>
+  <x:extra a="1">t<![CDATA[d]]></x:extra>
+  <review status="doc reviewed"/>
+</package>""")
+    assert 'Some <b x:a="1">bold</b> &amp; <![CDATA[raw]]><!--c-->' == m.description
+    assert 'b' == m.brief
+    # CDATA sections are not part of the text of an element
+    assert 'BSD' == m.license
+    assert 'http://l' == m.license_url
+    assert 'A, B' == m.author
+    assert 'doc reviewed' == m.status
+    assert '' == m.notes
+    assert m.url is None and m.version is None
+    assert [('cpp', {'cflags': '-I${prefix}'}, ''), ('python', {'path': '${prefix}/src'}, 'txtmore')] == \
+        [(e.tag, e.attrs, e.str) for e in m.exports]
+    assert ['<x:extra a="1">t<![CDATA[d]]></x:extra>'] == [e.toxml() for e in m.unknown_tags]
+    assert 'http://x' == m.unknown_tags[0].namespaceURI
+
+    m = parse_manifest(MANIFEST_FILE, '<package/>')
+    assert m.description is None and m.author is None
+    assert '' == m.license and 'unreviewed' == m.status
+
+    for manifest_name, contents, message in [
+        (MANIFEST_FILE, '<package>', '[f] invalid XML: no element found: line 1, column 9'),
+        (MANIFEST_FILE, '<stack/>', "manifest [f] must have a single 'package' element"),
+        (MANIFEST_FILE, '<package><url/><url/></package>', "Invalid manifest file [f]: must have a single 'url' element"),
+        (MANIFEST_FILE, '<package><license/><license/></package>', "Invalid manifest file: must have only one 'license' element"),
+        (MANIFEST_FILE, '<package><depend stack="a"/></package>', "Invalid manifest file [f]: depends is missing 'package' attribute"),
+        (MANIFEST_FILE, '<package><rosdep/></package>', 'invalid rosdep tag in [f]'),
+        (MANIFEST_FILE, '<package><platform os="a"/></package>', "<platform> tag is missing required ''version'' attribute"),
+        (STACK_FILE, '<stack><rosdep name="a"/></stack>', 'stack manifests are not allowed to have rosdeps'),
+    ]:
+        try:
+            parse_manifest(manifest_name, contents, 'f')
+            assert False, "parse should have failed on %s" % contents
+        except InvalidManifest as e:
+            assert message == str(e)
+
+
+def test_parse_manifest_lazy():
+    import pickle
+    from rospkg.manifest import parse_manifest, InvalidManifest, MANIFEST_FILE
+    eager = parse_manifest(MANIFEST_FILE, EXAMPLE1, 'f')
+    m = parse_manifest(MANIFEST_FILE, EXAMPLE1, 'f', lazy=True)
+    assert ['pkgname', 'common'] == [d.name for d in m.depends]
+    assert ['python', 'bar', 'baz'] == [r.name for r in m.rosdeps]
+    assert 2 == len(m.exports)
+    assert m._source is not None
+    # survives a round-trip through pickle undecoded
+    m = pickle.loads(pickle.dumps(m))
+    assert m._source is not None
+    for attr in ['description', 'brief', 'author', 'license', 'license_url', 'url', 'version', 'status', 'notes']:
+        assert getattr(eager, attr) == getattr(m, attr), attr
+    assert m._source is None
+    assert [e.toxml() for e in eager.unknown_tags] == [e.toxml() for e in m.unknown_tags]
+
+    # fields set before they are decoded are kept
+    m = parse_manifest(MANIFEST_FILE, EXAMPLE1, 'f', lazy=True)
+    m.author = 'someone'
+    assert 'someone' == m.author
+    assert eager.license == m.license
+
+    # validated in full up front
+    try:
+        parse_manifest(MANIFEST_FILE, '<package><url/><url/></package>', 'f', lazy=True)
+        assert False, "parse should have failed"
+    except InvalidManifest as e:
+        assert "Invalid manifest file [f]: must have a single 'url' element" == str(e)
+
+
 EXAMPLE1 = u"""<package>
   <description brief="a brief description">Line 1
 Line 2
@@ -31,8 +31,11 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import os
+import shutil
 import subprocess
 import tempfile
+import time
+from unittest.mock import patch
 
 
 def get_package_test_path():
@@ -207,6 +210,431 @@ def test_RosPack_get_path():
             assert retval == rospackval, "[%s]: %s vs. %s" % (p, retval, rospackval)
 
 
+def _age_tree(path, seconds=60):
+    # move mtimes out of the window in which directories are considered
+    # to be still changing
+    t = time.time() - seconds
+    for d, dirs, files in os.walk(path):
+        for f in files:
+            os.utime(os.path.join(d, f), (t, t))
+        os.utime(d, (t, t))
+
+
+def test_RosPack_persistent_index():
+    from rospkg import RosPack
+
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'ws')
+        shutil.copytree(get_package_test_path(), path)
+        _age_tree(path)
+        ros_paths = [os.path.join(path, 'p1'), os.path.join(path, 'p2')]
+        with patch.dict(os.environ, {'ROS_HOME': os.path.join(tmp, 'ros_home')}):
+            r = RosPack(ros_paths=ros_paths, persistent_index=True)
+            assert os.path.join(path, 'p1', 'foo') == r.get_path('foo')
+            assert os.listdir(os.path.join(tmp, 'ros_home', 'rospkg_cache'))
+
+            # a new process is served from the index without crawling
+            with patch('rospkg.rospack._workspace_indexes', {}), patch('rospkg.rospack._crawl') as crawl:
+                r = RosPack(ros_paths=ros_paths, persistent_index=True)
+                assert os.path.join(path, 'p1', 'foo') == r.get_path('foo')
+                assert set(['foo', 'bar', 'baz', 'invalid']) == set(r.list())
+                assert not crawl.called
+
+            # a different path order is indexed separately
+            r = RosPack(ros_paths=list(reversed(ros_paths)), persistent_index=True)
+            assert os.path.join(path, 'p2', 'foo') == r.get_path('foo')
+
+            # adding a package invalidates the index
+            os.makedirs(os.path.join(path, 'p2', 'qux'))
+            with open(os.path.join(path, 'p2', 'qux', 'manifest.xml'), 'w') as f:
+                f.write('<package/>')
+            r = RosPack(ros_paths=ros_paths, persistent_index=True)
+            assert os.path.join(path, 'p2', 'qux') == r.get_path('qux')
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_RosPack_persistent_manifests():
+    from rospkg import RosPack
+
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'ws')
+        shutil.copytree(get_package_test_path(), path)
+        _age_tree(path)
+        ros_paths = [os.path.join(path, 'p1'), os.path.join(path, 'p2')]
+        with patch.dict(os.environ, {'ROS_HOME': os.path.join(tmp, 'ros_home')}), \
+                patch('rospkg.rospack._manifest_stores', {}):
+            r = RosPack(ros_paths=ros_paths, persistent_manifests=True)
+            m = r.get_manifest('bar')
+            assert ['foo'] == r.get_depends('bar')
+
+            # a new process is served from the store without parsing
+            with patch('rospkg.rospack._manifest_stores', {}), patch('rospkg.rospack.parse_manifest_file') as parse:
+                r = RosPack(ros_paths=ros_paths, persistent_manifests=True)
+                cached = r.get_manifest('bar')
+                assert ['foo'] == r.get_depends('bar')
+                assert not parse.called
+            for attr in ['description', 'brief', 'author', 'license', 'license_url', 'url', 'version',
+                         'status', 'notes', 'type', 'filename', 'is_catkin']:
+                assert getattr(m, attr) == getattr(cached, attr), attr
+            assert m.depends == cached.depends
+            assert [r.name for r in m.rosdeps] == [r.name for r in cached.rosdeps]
+            assert [(e.tag, e.attrs, e.str) for e in m.exports] == [(e.tag, e.attrs, e.str) for e in cached.exports]
+
+            # a changed manifest is parsed again
+            with open(os.path.join(path, 'p1', 'bar', 'manifest.xml'), 'w') as f:
+                f.write('<package/>')
+            _age_tree(path)
+            with patch('rospkg.rospack._manifest_stores', {}):
+                r = RosPack(ros_paths=ros_paths, persistent_manifests=True)
+                assert [] == r.get_depends('bar')
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_RosPack_persistent_manifests_catkin():
+    import sys
+    import types
+    from rospkg import RosPack
+    from rospkg.manifest import parse_manifest_file
+
+    def write_package(path, depends):
+        os.makedirs(path)
+        with open(os.path.join(path, 'package.xml'), 'w') as f:
+            f.write('<package format="2"><name>%s</name><version>0.1.0</version><description>d</description>'
+                    '<maintainer email="m@example.com">m</maintainer><license>BSD</license>%s</package>'
+                    % (os.path.basename(path), ''.join('<depend>%s</depend>' % d for d in depends)))
+
+    rosdep = types.ModuleType('rosdep2.rospack')
+    rosdep.init_rospack_interface = lambda: object()
+    rosdep.is_view_empty = lambda view: False
+    rosdep.is_ros_package = lambda view, name: False
+    rosdep.is_system_dependency = lambda view, name: name == 'boost'
+
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'ws')
+        write_package(os.path.join(path, 'a'), ['b', 'c', 'boost'])
+        write_package(os.path.join(path, 'b'), [])
+        _age_tree(path)
+        ros_home = os.path.join(tmp, 'ros_home')
+        with patch.dict(os.environ, {'ROS_HOME': ros_home}), \
+                patch('rospkg.rospack._manifest_stores', {}), \
+                patch('rospkg.manifest._static_rosdep_view', None):
+            # without rosdep no dependencies are classified, which is not stored
+            with patch.dict(sys.modules, {'rosdep2': None}):
+                r = RosPack(ros_paths=[path], persistent_manifests=True)
+                assert [] == r.get_depends('a', implicit=False)
+
+            with patch.dict(sys.modules, {'rosdep2': types.ModuleType('rosdep2'), 'rosdep2.rospack': rosdep}):
+                with patch('rospkg.rospack._manifest_stores', {}):
+                    r = RosPack(ros_paths=[path], persistent_manifests=True)
+                    assert ['b'] == r.get_depends('a', implicit=False)
+                    assert ['boost'] == [d.name for d in r.get_manifest('a').rosdeps]
+                with patch('rospkg.rospack._manifest_stores', {}), patch('rospkg.rospack.parse_manifest_file') as parse:
+                    r = RosPack(ros_paths=[path], persistent_manifests=True)
+                    assert ['b'] == r.get_depends('a', implicit=False)
+                    assert ['boost'] == [d.name for d in r.get_manifest('a').rosdeps]
+                    assert not parse.called
+
+                # a new package changes the classification, also for
+                # a manager that is refreshed
+                classification = r._manifest_store._get_classification(r)
+                write_package(os.path.join(path, 'c'), [])
+                _age_tree(path)
+                assert 'c' in r.refresh()
+                assert classification != r._manifest_store._get_classification(r)
+                with patch('rospkg.rospack._manifest_stores', {}):
+                    r = RosPack(ros_paths=[path], persistent_manifests=True)
+                    assert ['b', 'c'] == sorted(r.get_depends('a', implicit=False))
+
+                # and so does 'rosdep update'
+                os.makedirs(os.path.join(ros_home, 'rosdep', 'sources.cache'))
+                with patch('rospkg.rospack._manifest_stores', {}), \
+                        patch('rospkg.rospack.parse_manifest_file', wraps=parse_manifest_file) as parse:
+                    r = RosPack(ros_paths=[path], persistent_manifests=True)
+                    assert ['b', 'c'] == sorted(r.get_depends('a', implicit=False))
+                    assert parse.called
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_RosPack_get_manifest_lazy():
+    from rospkg import RosPack
+    from rospkg.manifest import _LazyManifest
+    path = get_package_test_path()
+    r = RosPack(ros_paths=[os.path.join(path, 'p1'), os.path.join(path, 'p2')])
+    m = r.get_manifest('bar')
+    assert isinstance(m, _LazyManifest)
+    assert m._source is not None
+    assert ['foo'] == [d.name for d in m.depends]
+    # decoded on first access
+    assert 'bar' == m.brief
+    assert m._source is None
+    manifests, errors = r.load_all_manifests(workers=1)
+    assert all(isinstance(m, _LazyManifest) for m in manifests.values())
+
+
+def test_RosPack_load_all_manifests():
+    from rospkg import InvalidManifest, ResourceNotFound, RosPack
+    path = get_package_test_path()
+    ros_paths = [os.path.join(path, 'p1'), os.path.join(path, 'p2')]
+    for workers in [1, 2]:
+        r = RosPack(ros_paths=ros_paths)
+        cached = r.get_manifest('bar')
+        manifests, errors = r.load_all_manifests(workers=workers)
+        assert set(['foo', 'bar', 'baz']) == set(manifests)
+        assert cached is manifests['bar']
+        assert ['invalid'] == list(errors)
+        assert isinstance(errors['invalid'], InvalidManifest)
+        # merged into the cache
+        assert manifests['foo'] is r.get_manifest('foo')
+        assert ['foo'] == [d.name for d in manifests['bar'].depends]
+        assert 'foo' == manifests['foo'].brief
+
+    # no worker processes unless asked for
+    with patch('os.cpu_count', return_value=4), patch('rospkg.rospack.ProcessPoolExecutor') as pool:
+        r = RosPack(ros_paths=ros_paths)
+        manifests, errors = r.load_all_manifests()
+        assert set(['foo', 'bar', 'baz']) == set(manifests)
+        assert not pool.called
+
+    r = RosPack(ros_paths=ros_paths)
+    manifests, errors = r.load_all_manifests(['foo', 'nonexistent'])
+    assert ['foo'] == list(manifests)
+    assert isinstance(errors['nonexistent'], ResourceNotFound)
+
+
+def test_RosPack_find_exports():
+    from rospkg import RosPack
+
+    tmp = tempfile.mkdtemp()
+    try:
+        manifests = {
+            'a': '<package><export><nodelet plugin="${prefix}/a.xml"/><cpp cflags="-I"/></export></package>',
+            'b': '<package><export><nodelet plugin="${prefix}/b.xml"/><nodelet/></export></package>',
+            'c': '<package/>',
+            'bad': '<package><depend/></package>',
+        }
+        for name, contents in manifests.items():
+            os.makedirs(os.path.join(tmp, name))
+            with open(os.path.join(tmp, name, 'manifest.xml'), 'w') as f:
+                f.write(contents)
+        _age_tree(tmp)
+        r = RosPack(ros_paths=[tmp])
+        expected = [(name, os.path.join(tmp, name, '%s.xml' % name)) for name in ['a', 'b']]
+        with patch('rospkg.rospack.ProcessPoolExecutor') as pool:
+            assert expected == sorted(r.find_exports('nodelet', 'plugin'))
+            assert not pool.called
+        assert sorted(r.find_exports('nodelet', 'plugin')) == \
+            sorted((name, value) for name in r.list() if name != 'bad'
+                   for value in r.get_manifest(name).get_export('nodelet', 'plugin'))
+        assert [('a', '-I')] == r.find_exports('cpp', 'cflags')
+        assert [] == r.find_exports('nodelet', 'missing')
+        assert [] == r.find_exports('missing', 'plugin')
+
+        # the index is discarded along with changed manifests
+        with open(os.path.join(tmp, 'c', 'manifest.xml'), 'w') as f:
+            f.write('<package><export><nodelet plugin="c.xml"/></export></package>')
+        assert ['c'] == r.refresh()
+        assert expected + [('c', 'c.xml')] == sorted(r.find_exports('nodelet', 'plugin'))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def _make_tree(root, files):
+    for f in files:
+        filename = os.path.join(root, *f.split('/'))
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as fh:
+            fh.write('<package/>' if f.endswith('.xml') else '')
+
+
+def test_list_by_path_pruning():
+    from rospkg import list_by_path
+
+    tmp = tempfile.mkdtemp()
+    try:
+        _make_tree(tmp, [
+            'a/manifest.xml',
+            'a/nested/manifest.xml',  # below a leaf
+            'ignored/CATKIN_IGNORE',
+            'ignored/b/manifest.xml',
+            'nosubdirs/rospack_nosubdirs',
+            'nosubdirs/c/manifest.xml',
+            '.hidden/d/manifest.xml',
+            'deep/er/e/manifest.xml',
+            'deep/e/manifest.xml',  # duplicate name, first one wins
+        ])
+        cache = {}
+        resources = list_by_path('manifest.xml', tmp, cache)
+        assert sorted(resources) == ['a', 'e']
+        assert cache['a'] == os.path.join(tmp, 'a')
+        assert cache['e'] in [os.path.join(tmp, 'deep', 'e'), os.path.join(tmp, 'deep', 'er', 'e')]
+        assert list_by_path('manifest.xml', os.path.join(tmp, 'missing'), {}) == []
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_RosPack_crawl_workers():
+    from rospkg import RosPack
+
+    path = get_package_test_path()
+    ros_paths = [os.path.join(path, 'p1'), os.path.join(path, 'p2')]
+    for paths in [ros_paths, list(reversed(ros_paths)), [path]]:
+        expected = RosPack(ros_paths=paths)
+        r = RosPack(ros_paths=paths, crawl_workers=4)
+        assert set(expected.list()) == set(r.list())
+        for p in expected.list():
+            assert expected.get_path(p) == r.get_path(p)
+
+
+def test_RosPack_refresh():
+    from rospkg import RosPack, ResourceNotFound
+
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'ws')
+        shutil.copytree(get_package_test_path(), path)
+        _age_tree(path)
+        ros_paths = [os.path.join(path, 'p1'), os.path.join(path, 'p2')]
+        r = RosPack(ros_paths=ros_paths)
+        assert [] == r.refresh()
+        assert 'baz' in r.list()
+        assert set(['foo', 'bar']) == set(r.get_depends('baz'))
+        assert ['foo'] == r.get_depends('bar')
+        locations = r._location_cache
+
+        # edit a manifest in place and add a package
+        with open(os.path.join(path, 'p1', 'bar', 'manifest.xml'), 'w') as f:
+            f.write('<package><license>BSD</license></package>')
+        _make_tree(path, ['p2/qux/manifest.xml'])
+        assert ['bar', 'qux'] == r.refresh()
+        assert locations is r._location_cache
+        assert os.path.join(path, 'p2', 'qux') == r.get_path('qux')
+        # unaffected packages stay cached
+        assert 'foo' in r._manifests
+        assert 'bar' not in r._manifests
+        assert 'baz' not in r._depends_cache
+        assert [] == r.get_depends('bar')
+        assert set(['foo', 'bar']) == set(r.get_depends('baz'))
+
+        # remove a package and let another one take precedence
+        shutil.rmtree(os.path.join(path, 'p2', 'baz'))
+        shutil.rmtree(os.path.join(path, 'p1', 'foo'))
+        assert ['baz', 'foo'] == r.refresh()
+        assert os.path.join(path, 'p2', 'foo') == r.get_path('foo')
+        try:
+            r.get_path('baz')
+            assert False, "should have raised"
+        except ResourceNotFound:
+            pass
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_workspace_index_shared():
+    import rospkg.rospack
+    from rospkg import RosPack, RosStack
+    from rospkg.common import PACKAGE_FILE
+    from rospkg.rospack import ManifestManager
+
+    path = os.path.join(get_stack_test_path(), 's1')
+    with patch('rospkg.rospack._workspace_indexes', {}), \
+            patch('rospkg.rospack._crawl', wraps=rospkg.rospack._crawl) as crawl:
+        rp = RosPack(ros_paths=[path])
+        rs = RosStack(ros_paths=[path])
+        mm = ManifestManager(PACKAGE_FILE, ros_paths=[path])
+        assert set(['foo_pkg', 'foo_pkg_2', 'bar_pkg']) == set(rp.list())
+        assert set(['foo', 'bar']) == set(rs.list())
+        assert [] == mm.list()
+        assert set(['foo_pkg', 'foo_pkg_2']) == set(rs.packages_of('foo'))
+        assert rp.get_workspace_index() is rs.get_workspace_index()
+        assert 1 == crawl.call_count
+
+
+def test_workspace_index_racy():
+    import rospkg.rospack
+    from rospkg import RosPack
+
+    tmp = tempfile.mkdtemp()
+    try:
+        _make_tree(tmp, ['a/manifest.xml'])
+        with patch('rospkg.rospack._workspace_indexes', {}):
+            assert ['a'] == RosPack(ros_paths=[tmp]).list()
+            # a package added within the timestamp tick of the listing,
+            # which does not change the mtime recorded for the directory
+            st = os.stat(tmp)
+            _make_tree(tmp, ['b/manifest.xml'])
+            os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+            assert ['a', 'b'] == sorted(RosPack(ros_paths=[tmp]).list())
+
+            # once listed out of the racy window, the index is reused
+            _age_tree(tmp)
+            assert ['a', 'b'] == sorted(RosPack(ros_paths=[tmp]).list())
+            assert rospkg.rospack.get_workspace_index([tmp]).is_current()
+            with patch('rospkg.rospack._scan_dir') as scan_dir:
+                assert ['a', 'b'] == sorted(RosPack(ros_paths=[tmp]).list())
+                assert not scan_dir.called
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_workspace_index_bounded():
+    import rospkg.rospack
+    from rospkg import RosPack
+
+    path = get_package_test_path()
+    limit = rospkg.rospack._SHARED_LIMIT
+    with patch('rospkg.rospack._workspace_indexes', {}):
+        r = RosPack(ros_paths=[path])
+        index = r.get_workspace_index()
+        paths = [os.path.join(path, 'missing%d' % i) for i in range(2 * limit)]
+        for p in paths:
+            RosPack(ros_paths=[p]).list()
+        indexes = rospkg.rospack._workspace_indexes
+        assert limit == len(indexes)
+        assert [(p,) for p in paths[-limit:]] == list(indexes)
+        # kept by the managers that use them
+        assert index not in indexes.values()
+        assert index is r.get_workspace_index()
+        # recently used ones are shared
+        assert indexes[(paths[-1],)] is RosPack(ros_paths=[paths[-1]]).get_workspace_index()
+
+
+def test_read_package_header():
+    from xml.etree.ElementTree import ParseError
+    from rospkg.rospack import _read_package_header
+
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp, 'package.xml')
+        for xml, expected in [
+            ('<package><name> foo\n</name></package>', (' foo\n', False)),
+            ('<package><name>foo</name><export><metapackage/></export></package>', ('foo', True)),
+            ('<package><export><metapackage/></export><name>foo</name></package>', ('foo', True)),
+            ('<package><export><nodelet/></export><name>foo</name></package>', ('foo', False)),
+            ('<package><depend>name</depend></package>', (None, False)),
+            # parsing stops once the header is complete
+            ('<package><name>foo</name><export/><unclosed></package>', ('foo', False)),
+        ]:
+            with open(filename, 'w') as f:
+                f.write(xml)
+            assert expected == _read_package_header(filename), xml
+        with open(filename, 'w') as f:
+            f.write('<package><name>foo</nam></package>')
+        try:
+            _read_package_header(filename)
+            assert False, "should have raised"
+        except ParseError:
+            pass
+    finally:
+        shutil.rmtree(tmp)
+
+
 def test_RosPackage_get_depends():
     from rospkg import RosPack, ResourceNotFound, get_ros_root
     path = get_package_test_path()
@@ -308,6 +736,91 @@ def test_RosPack_get_rosdeps():
     assert set(['baz_rosdep1', 'foo_rosdep1', 'foo_rosdep2', 'foo_rosdep3', 'bar_rosdep1', 'bar_rosdep2']) == set(r.get_rosdeps('baz'))
 
 
+def test_RosPack_get_depends_many():
+    from rospkg import RosPack, ResourceNotFound
+
+    path = get_package_test_path()
+    r = RosPack(ros_paths=[os.path.join(path, 'p1'), os.path.join(path, 'p2')])
+    depends, union = r.get_depends_many(['bar', 'baz', 'bar'])
+    assert ['bar', 'baz'] == sorted(depends)
+    assert ['foo'] == depends['bar']
+    assert set(['foo', 'bar']) == set(depends['baz'])
+    assert 2 == len(union) and set(['foo', 'bar']) == set(union)
+    assert depends['baz'] == r.get_depends('baz')
+    assert depends['baz'] == r.get_depends_many(['baz'])[1]
+    depends, union = r.get_depends_many(['foo', 'baz'], implicit=False)
+    assert {'foo': [], 'baz': r.get_depends('baz', implicit=False)} == depends
+    assert depends['baz'] == union
+    assert ({}, []) == r.get_depends_many([])
+
+    # each manifest is parsed once
+    import rospkg.rospack
+    r = RosPack(ros_paths=[os.path.join(path, 'p1'), os.path.join(path, 'p2')])
+    with patch('rospkg.rospack.parse_manifest_file', side_effect=rospkg.rospack.parse_manifest_file) as parse:
+        rosdeps, union = r.get_rosdeps_many(['baz', 'bar', 'foo'])
+    assert 3 == parse.call_count
+    for name in ('foo', 'bar', 'baz'):
+        assert sorted(r.get_rosdeps(name)) == sorted(rosdeps[name])
+    assert sorted(rosdeps['baz']) == sorted(union)
+    rosdeps, union = r.get_rosdeps_many(['bar', 'baz'], implicit=False)
+    assert ['bar_rosdep1', 'bar_rosdep2', 'baz_rosdep1'] == sorted(union)
+    assert ['baz_rosdep1'] == rosdeps['baz']
+
+    try:
+        r.get_depends_many(['foo', 'bad'])
+        assert False, 'should have raised'
+    except ResourceNotFound:
+        pass
+
+
+def test_PackageResolver():
+    from rospkg import get_package_name, PackageResolver
+
+    tmp = tempfile.mkdtemp()
+    try:
+        _make_tree(tmp, [
+            'ws/src/foo/manifest.xml',
+            'ws/src/foo/src/foo.cpp',
+            'ws/src/foo/baz/x.py',
+            'ws/src/bar/include/bar/bar.h',
+            'ws/README',
+        ])
+        with open(os.path.join(tmp, 'ws', 'src', 'bar', 'package.xml'), 'w') as f:
+            f.write('<package><name>bar_pkg</name></package>')
+        os.symlink(os.path.join(tmp, 'ws'), os.path.join(tmp, 'checkout'))
+        os.symlink(os.path.join(tmp, 'ws', 'src', 'foo', 'src', 'foo.cpp'),
+                   os.path.join(tmp, 'ws', 'src', 'bar', 'foo.cpp'))
+        # '..' applies to the target of a symlink
+        os.symlink(os.path.join(tmp, 'ws', 'src', 'bar', 'include'),
+                   os.path.join(tmp, 'ws', 'src', 'foo', 'src', 'link'))
+        paths = [os.path.join(tmp, *p.split('/')) for p in [
+            'ws/src/foo/src/foo.cpp',
+            'ws/src/foo/src/removed.cpp',
+            'ws/src/foo/baz',
+            'ws/src/foo',
+            'ws/src/bar/include/bar/bar.h',
+            'ws/src/bar/foo.cpp',
+            'ws/src/bar/include/../../foo/src/foo.cpp',
+            'checkout/src/bar/include/bar/bar.h',
+            'ws/src/foo/src/link/../f.py',
+            'ws/src/foo/src/link/..',
+            'ws/src/foo/src/link/bar/.',
+            'ws/README',
+            'ws/src',
+        ]]
+        expected = ['foo', 'foo', 'foo', 'foo', 'bar_pkg', 'foo', 'foo', 'bar_pkg', 'bar_pkg', 'bar_pkg', 'bar_pkg', None, None]
+        r = PackageResolver()
+        assert expected == r.resolve_many(paths)
+        assert expected == [get_package_name(p) for p in paths]
+        # memoized
+        with patch('os.scandir') as scandir:
+            assert expected == r.resolve_many(paths)
+        assert not scandir.called
+        assert 'foo' == r.resolve(os.path.relpath(paths[0]))
+    finally:
+        shutil.rmtree(tmp)
+
+
 def test_get_package_name():
     from rospkg import __version__
     from rospkg import get_package_name
@@ -356,3 +869,346 @@ def test_get_depends_on():
             retval = set(r.get_depends_on(p, True))
             rospackval = set(rospack_depends_on(p))
             assert retval == rospackval, "[%s]: %s vs. %s" % (p, retval, rospackval)
+
+
+def test_get_depends_on_index():
+    from rospkg import RosPack
+
+    tmp = tempfile.mkdtemp()
+    try:
+        manifests = {
+            'a': '',
+            'b': '<depend package="a"/><depend package="a"/>',
+            'c': '<depend package="b"/>',
+            'd': '<depend package="b"/><depend package="missing"/>',
+            'e': '<depend package="f"/>',
+            'f': '<depend package="a"/><depend',
+            'g': '<depend package="c"/><depend package="a"/>',
+        }
+        for name, depends in manifests.items():
+            os.makedirs(os.path.join(tmp, name))
+            with open(os.path.join(tmp, name, 'manifest.xml'), 'w') as f:
+                f.write('<package>%s</package>' % depends)
+        r = RosPack(ros_paths=[tmp])
+        # skips the invalid manifest of f
+        assert ['b', 'g'] == sorted(r.get_depends_on('a', implicit=False))
+        assert ['b', 'c', 'g'] == sorted(r.get_depends_on('a'))
+        # d depends on a missing package, e on an invalid manifest
+        assert ['c', 'g'] == sorted(r.get_depends_on('b'))
+        assert ['d'] == r.get_depends_on('missing', implicit=False)
+        assert [] == r.get_depends_on('missing')
+        assert [] == r.get_depends_on('f')
+
+        # repeated calls do not load manifests again
+        with patch.object(r, 'get_manifest') as get_manifest:
+            assert ['c', 'g'] == sorted(r.get_depends_on('b'))
+            assert ['c', 'd'] == r.get_depends_on('b', implicit=False)
+        assert not get_manifest.called
+
+        # the index is rebuilt after a refresh
+        with open(os.path.join(tmp, 'f', 'manifest.xml'), 'w') as f:
+            f.write('<package><depend package="a"/></package>')
+        _age_tree(tmp)
+        r.refresh()
+        assert ['b', 'c', 'e', 'f', 'g'] == sorted(r.get_depends_on('a'))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_get_depends_cycles():
+    import sys
+    from rospkg import RosPack, ResourceNotFound
+
+    tmp = tempfile.mkdtemp()
+    try:
+        manifests = {
+            'a': 'b',
+            'b': 'c',
+            'c': 'a d',
+            'd': '',
+            'e': 'f',
+            'f': 'e missing',
+        }
+        for name, depends in manifests.items():
+            os.makedirs(os.path.join(tmp, name))
+            with open(os.path.join(tmp, name, 'manifest.xml'), 'w') as f:
+                f.write('<package>%s</package>' % ''.join(
+                    '<depend package="%s"/>' % d for d in depends.split()))
+        for order in (['a', 'b', 'c'], ['c', 'b', 'a'], ['b', 'a', 'c']):
+            r = RosPack(ros_paths=[tmp])
+            for name in order:
+                assert ['a', 'b', 'c', 'd'] == sorted(r.get_depends(name)), name
+            # members of a cycle share one closure
+            assert r.get_depends('a') is r.get_depends('c')
+        assert [] == r.get_depends('d')
+
+        # nothing is cached for a cycle with a missing dependency
+        for name in ('e', 'f'):
+            try:
+                r.get_depends(name)
+                assert False, 'should have raised'
+            except ResourceNotFound:
+                pass
+        assert 'e' not in r._depends_cache
+        assert 'f' not in r._depends_cache
+    finally:
+        shutil.rmtree(tmp)
+
+    # dependency chains longer than the recursion limit
+    class Manifest(object):
+        def __init__(self, depends):
+            self.depends = [Depend(d) for d in depends]
+
+    class Depend(object):
+        def __init__(self, name):
+            self.name = name
+
+    n = sys.getrecursionlimit() + 100
+    r = RosPack(ros_paths=[])
+    with patch.object(r, 'get_manifest',
+                      side_effect=lambda p: Manifest(['p%d' % (int(p[1:]) + 1)] if int(p[1:]) < n else [])):
+        assert n == len(r.get_depends('p0'))
+        assert n - 1 == len(r.get_depends('p1'))
+
+
+def test_RosPack_iter_depends():
+    from rospkg import RosPack
+
+    tmp = tempfile.mkdtemp()
+    try:
+        manifests = {
+            'a': 'b c',
+            'b': 'd',
+            'c': 'e',
+            'd': 'f',
+            'e': 'a',
+            'f': '',
+        }
+        for name, depends in manifests.items():
+            os.makedirs(os.path.join(tmp, name))
+            with open(os.path.join(tmp, name, 'manifest.xml'), 'w') as f:
+                f.write('<package>%s</package>' % ''.join(
+                    '<depend package="%s"/>' % d for d in depends.split()))
+        r = RosPack(ros_paths=[tmp])
+        assert ['b', 'c', 'd', 'e', 'a', 'f'] == list(r.iter_depends('a'))
+        assert ['b', 'd', 'f', 'c', 'e', 'a'] == list(r.iter_depends('a', order='dfs'))
+        assert sorted(r.get_depends('a')) == sorted(r.iter_depends('a', order='dfs'))
+        assert ['b', 'c'] == list(r.iter_depends('a', max_depth=1))
+        assert [] == list(r.iter_depends('a', max_depth=0))
+        assert ['b', 'c', 'e', 'a'] == list(r.iter_depends('a', prune=lambda p: p == 'b'))
+        assert ['d', 'e', 'a', 'f'] == list(r.iter_depends('a', predicate=lambda p: p not in ('b', 'c')))
+        try:
+            list(r.iter_depends('a', order='random'))
+            assert False, 'should have raised'
+        except ValueError:
+            pass
+
+        # manifests are only loaded as the iteration proceeds
+        r = RosPack(ros_paths=[tmp])
+        with patch.object(r, 'get_manifest', side_effect=r.get_manifest) as get_manifest:
+            assert 'b' == next(r.iter_depends('a'))
+        assert 1 == get_manifest.call_count
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_RosPack_get_affected():
+    from rospkg import RosPack
+
+    tmp = tempfile.mkdtemp()
+    try:
+        manifests = {
+            'a': '',
+            'b': '<depend package="a"/>',
+            'c': '<depend package="b"/><depend package="missing"/>',
+            'd': '',
+            'e': '<depend package="a"/><depend',
+        }
+        for name, depends in manifests.items():
+            os.makedirs(os.path.join(tmp, 'src', name, 'include', name))
+            with open(os.path.join(tmp, 'src', name, 'manifest.xml'), 'w') as f:
+                f.write('<package>%s</package>' % depends)
+        os.symlink(os.path.join(tmp, 'src'), os.path.join(tmp, 'link'))
+        r = RosPack(ros_paths=[os.path.join(tmp, 'src')])
+
+        assert [] == r.get_affected([])
+        assert [] == r.get_affected([os.path.join(tmp, 'README'), os.path.join(tmp, 'src', 'CMakeLists.txt')])
+        a_header = os.path.join(tmp, 'src', 'a', 'include', 'a', 'a.h')
+        # c depends on a missing package, but is still affected
+        assert ['a', 'b', 'c'] == sorted(r.get_affected([a_header]))
+        assert ['a', 'b'] == sorted(r.get_affected([a_header], implicit=False))
+        assert ['b', 'c', 'd'] == sorted(r.get_affected([
+            os.path.join(tmp, 'src', 'b'),
+            os.path.join(tmp, 'src', 'd', 'manifest.xml'),
+            os.path.join(tmp, 'src', 'd', 'include', '..', '..', 'b', 'x.cpp'),
+        ]))
+        assert ['d'] == r.get_affected([os.path.relpath(os.path.join(tmp, 'src', 'd', 'x.py'))])
+        # paths are matched both as located and with symlinks resolved
+        r = RosPack(ros_paths=[os.path.join(tmp, 'link')])
+        assert ['d'] == r.get_affected([os.path.join(tmp, 'link', 'd', 'x.py')])
+        assert ['d'] == r.get_affected([os.path.join(os.path.realpath(tmp), 'src', 'd', 'x.py')])
+        assert [] == r.get_affected([os.path.join(tmp, 'src', 'd', '..')])
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_RosPack_get_path_targeted():
+    import rospkg.rospack
+    from rospkg import RosPack, ResourceNotFound
+
+    tmp = tempfile.mkdtemp()
+    try:
+        _make_tree(tmp, [
+            'p1/share/foo/manifest.xml',
+            'p1/src/a/b/bar/manifest.xml',
+            'p1/ignored/CATKIN_IGNORE',
+            'p1/ignored/baz/manifest.xml',
+            'p2/bar/manifest.xml',
+            'p2/baz/manifest.xml',
+        ])
+        p1, p2 = os.path.join(tmp, 'p1'), os.path.join(tmp, 'p2')
+        with patch('rospkg.rospack._workspace_indexes', {}), \
+                patch('rospkg.rospack._visit_dir', wraps=rospkg.rospack._visit_dir) as visit_dir:
+            r = RosPack(ros_paths=[p1, p2])
+            # found where it usually is, without listing the ROS path
+            assert os.path.join(p1, 'share', 'foo') == r.get_path('foo')
+            assert [os.path.join(p1, 'share', 'foo')] == [c[0][0] for c in visit_dir.call_args_list]
+            assert not r.get_workspace_index().is_built()
+            # precedence is decided by the earlier ROS path
+            assert os.path.join(p1, 'src', 'a', 'b', 'bar') == r.get_path('bar')
+            assert os.path.join(p2, 'baz') == r.get_path('baz')
+            try:
+                r.get_path('qux')
+                assert False, 'should have raised'
+            except ResourceNotFound:
+                pass
+            # the full index is built from the directories listed so far
+            assert r.get_workspace_index().is_built()
+            visited = [c[0][0] for c in visit_dir.call_args_list]
+            assert len(visited) == len(set(visited))
+        assert set(['foo', 'bar', 'baz']) == set(r.list())
+        assert RosPack(ros_paths=[p1, p2]).get_path('bar') == r.get_path('bar')
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_RosPack_get_path_targeted_duplicate():
+    import rospkg.rospack
+    from rospkg import RosPack
+
+    scan_dir = rospkg.rospack._scan_dir
+
+    def scan_dir_reversed(d):
+        # the crawl reaches zzz/foo before foo
+        listing = scan_dir(d)
+        if listing is not None:
+            listing = listing[0], sorted(listing[1], reverse=True), listing[2]
+        return listing
+
+    tmp = tempfile.mkdtemp()
+    try:
+        _make_tree(tmp, ['r/foo/manifest.xml', 'r/zzz/foo/manifest.xml'])
+        r_path = os.path.join(tmp, 'r')
+        with open(os.path.join(r_path, 'zzz', 'foo', 'manifest.xml'), 'w') as f:
+            f.write('<package><depend package="bar"/></package>')
+        with patch('rospkg.rospack._workspace_indexes', {}), \
+                patch('rospkg.rospack._scan_dir', side_effect=scan_dir_reversed):
+            r = RosPack(ros_paths=[r_path])
+            # the probe finds the usual location first
+            assert os.path.join(r_path, 'foo') == r.get_path('foo')
+            assert [] == r.get_depends('foo', implicit=False)
+            assert os.path.join(r_path, 'foo', 'manifest.xml') == r.get_manifest('foo').filename
+            assert ['foo'] == r.list()
+            # the crawl takes precedence, along with what was cached
+            assert os.path.join(r_path, 'zzz', 'foo') == r.get_path('foo')
+            assert os.path.join(r_path, 'zzz', 'foo', 'manifest.xml') == r.get_manifest('foo').filename
+            assert ['bar'] == r.get_depends('foo', implicit=False)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_RosPack_symlinks():
+    import rospkg.rospack
+    from rospkg import RosPack, list_by_path, MANIFEST_FILE
+
+    tmp = tempfile.mkdtemp()
+    try:
+        _make_tree(tmp, [
+            'src/a/foo/manifest.xml',
+            'src/a/b/c/bar/manifest.xml',
+        ])
+        src = os.path.join(tmp, 'src')
+        # a cycle and a farm of links to the same directories
+        os.symlink(src, os.path.join(src, 'a', 'b', 'loop'))
+        os.mkdir(os.path.join(tmp, 'farm'))
+        for i in range(5):
+            os.symlink(os.path.join(src, 'a'), os.path.join(tmp, 'farm', 'a%d' % i))
+        os.symlink(os.path.join(src, 'a', 'foo'), os.path.join(tmp, 'farm', 'foo2'))
+
+        cache = {}
+        assert ['bar', 'foo'] == sorted(list_by_path(MANIFEST_FILE, src, cache))
+        assert os.path.join(src, 'a', 'b', 'c', 'bar') == cache['bar']
+
+        with patch('rospkg.rospack._workspace_indexes', {}), \
+                patch('rospkg.rospack._scan_dir', wraps=rospkg.rospack._scan_dir) as scan_dir:
+            for crawl_workers in [None, 4]:
+                scan_dir.reset_mock()
+                rospkg.rospack._workspace_indexes.clear()
+                r = RosPack(ros_paths=[src, os.path.join(tmp, 'farm')], crawl_workers=crawl_workers)
+                assert set(['foo', 'bar', 'foo2']) == set(r.list())
+                assert os.path.join(src, 'a', 'foo') == r.get_path('foo')
+                # each link is listed, but not descended into
+                aliases = r.get_workspace_index().get_aliases()
+                assert os.path.join(src, 'a', 'b', 'loop') in aliases
+                assert 6 == len([d for d in aliases if d.startswith(os.path.join(tmp, 'farm'))])
+                if crawl_workers is None:
+                    assert 7 + len(aliases) == scan_dir.call_count
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_RosPack_get_crawl_stats():
+    from rospkg import RosPack
+
+    tmp = tempfile.mkdtemp()
+    try:
+        _make_tree(tmp, [
+            'p1/foo/manifest.xml',
+            'p1/bar/package.xml',
+            'p1/ignored/CATKIN_IGNORE',
+            'p1/ignored/baz/manifest.xml',
+            'p1/nosubdirs/rospack_nosubdirs',
+            'p1/nosubdirs/baz/manifest.xml',
+            'p1/.hidden/baz/manifest.xml',
+            'p1/stack/stack.xml',
+            'p1/stack/qux/manifest.xml',
+            'p2/baz/manifest.xml',
+        ])
+        p1, p2 = os.path.join(tmp, 'p1'), os.path.join(tmp, 'p2')
+        os.symlink(os.path.join(p1, 'stack'), os.path.join(p1, 'link'))
+        with patch('rospkg.rospack._workspace_indexes', {}), \
+                patch('rospkg.rospack._logger') as logger:
+            r = RosPack(ros_paths=[p1, p2, os.path.join(tmp, 'missing')])
+            assert r.get_crawl_stats() is None
+            r.list()
+            stats = r.get_crawl_stats()
+            assert [p1, p2, os.path.join(tmp, 'missing')] == [s.path for s in stats]
+            assert 3 == logger.debug.call_count
+            assert stats[0] is logger.debug.call_args_list[0][1]['extra']['crawl_stats']
+
+        s1, s2, s3 = stats
+        # p1, foo, bar, ignored, nosubdirs, stack, qux, link
+        assert 8 == s1.visited
+        assert 0 == s1.unlistable
+        assert 1 == s1.ignored
+        assert 1 == s1.nosubdirs
+        assert 3 == s1.leaves
+        assert 1 == s1.hidden
+        assert 1 == s1.aliases
+        assert 1 == s1.packages_parsed
+        assert s1.seconds >= 0
+        assert (2, 1, 0) == (s2.visited, s2.leaves, s2.aliases)
+        assert (1, 1) == (s3.visited, s3.unlistable)
+        assert p1 in str(s1)
+    finally:
+        shutil.rmtree(tmp)
@@ -31,7 +31,10 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import os
+import shutil
 import subprocess
+import tempfile
+from unittest.mock import patch
 
 
 def get_stack_test_path():
@@ -287,3 +290,52 @@ def test_unary():
 
     assert rosstack.packages_of('unary') == ['unary']
     assert rospack.stack_of('unary') == 'unary'
+
+
+def _make_tree(root, files):
+    for f in files:
+        filename = os.path.join(root, *f.split('/'))
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as fh:
+            fh.write('<package/>' if f.endswith('.xml') else '')
+
+
+def test_RosStack_symlinks():
+    from rospkg import list_by_path, MANIFEST_FILE, RosPack, RosStack, STACK_FILE
+
+    tmp = tempfile.mkdtemp()
+    try:
+        r0 = os.path.join(tmp, 'r0')
+        r1 = os.path.join(tmp, 'r1')
+        # the crawl descends into stacks, which the stack listing does
+        # not, so it reaches r1/b first through the link
+        _make_tree(tmp, ['r0/a_stack/stack.xml', 'r1/b/other_stack/stack.xml'])
+        os.symlink(os.path.join(r1, 'b'), os.path.join(r0, 'a_stack', 'link'))
+        with patch('rospkg.rospack._workspace_indexes', {}):
+            r = RosStack(ros_paths=[r0, r1])
+            assert ['a_stack', 'other_stack'] == sorted(r.list())
+            assert os.path.join(r1, 'b', 'other_stack') == r.get_path('other_stack')
+            r.refresh()
+            assert ['a_stack', 'other_stack'] == sorted(r.list())
+    finally:
+        shutil.rmtree(tmp)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        r0 = os.path.join(tmp, 'r0')
+        r1 = os.path.join(tmp, 'r1')
+        # an earlier ROS path reaches a subdirectory of a stack first
+        _make_tree(tmp, ['r0/foo', 'r1/stackA/stack.xml', 'r1/stackA/sub/pkgX/manifest.xml'])
+        os.symlink(os.path.join(r1, 'stackA', 'sub'), os.path.join(r0, 'link'))
+        expected = list_by_path(MANIFEST_FILE, os.path.join(r1, 'stackA'), {})
+        assert ['pkgX'] == expected
+        with patch('rospkg.rospack._workspace_indexes', {}):
+            rospack = RosPack(ros_paths=[r0, r1])
+            rosstack = RosStack(ros_paths=[r0, r1])
+            assert ['stackA'] == rosstack.list()
+            assert expected == rosstack.packages_of('stackA')
+            assert expected == rospack.get_workspace_index().list_by_path(MANIFEST_FILE, os.path.join(r0, 'link'))
+            assert [] == rospack.get_workspace_index().list_by_path(STACK_FILE, os.path.join(r0, 'link'))
+    finally:
+        shutil.rmtree(tmp)
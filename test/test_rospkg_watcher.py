@@ -0,0 +1,174 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2011, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import tempfile
+import time
+
+
+def _write(filename, text='<package/>'):
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    with open(filename, 'w') as f:
+        f.write(text)
+
+
+def _edit(filename, text):
+    # a distinct modification time, however coarse the filesystem's
+    _write(filename, text)
+    t = os.stat(filename).st_mtime + 1
+    os.utime(filename, (t, t))
+
+
+def _wait_for(condition, timeout=10.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def _check_watcher(use_inotify):
+    from rospkg import RosPack
+    from rospkg.watcher import Watcher
+
+    tmp = tempfile.mkdtemp()
+    try:
+        ws = os.path.join(tmp, 'ws')
+        missing = os.path.join(tmp, 'later', 'ws')
+        _write(os.path.join(ws, 'foo', 'manifest.xml'))
+        rp = RosPack(ros_paths=[ws, missing])
+        with Watcher(rp, interval=0.05, use_inotify=use_inotify) as w:
+            assert rp.list() == ['foo']
+            # new package in a new directory
+            _write(os.path.join(ws, 'sub', 'bar', 'manifest.xml'))
+            assert _wait_for(lambda: 'bar' in rp.list())
+            assert rp.get_path('bar') == os.path.join(ws, 'sub', 'bar')
+            # removed package
+            shutil.rmtree(os.path.join(ws, 'foo'))
+            assert _wait_for(lambda: 'foo' not in rp.list())
+            # ROS path that did not exist when the watcher was started
+            _write(os.path.join(missing, 'baz', 'manifest.xml'))
+            assert _wait_for(lambda: 'baz' in rp.list())
+            # edited manifest
+            assert rp.get_depends('bar', implicit=False) == []
+            _write(os.path.join(ws, 'sub', 'bar', 'manifest.xml'), '<package><depend package="baz"/></package>')
+            assert _wait_for(lambda: rp.get_depends('bar', implicit=False) == ['baz'])
+            assert w.last_error is None
+            assert w.is_inotify() == use_inotify
+        # stopped watchers leave the instance alone
+        _write(os.path.join(ws, 'qux', 'manifest.xml'))
+        time.sleep(0.2)
+        assert 'qux' not in rp.list()
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_Watcher_inotify():
+    from rospkg.watcher import _Inotify
+    try:
+        _Inotify().close()
+    except OSError:
+        # not on Linux
+        return
+    _check_watcher(True)
+
+
+def test_Watcher_polling():
+    _check_watcher(False)
+
+
+def test_Watcher_retry():
+    from rospkg import RosPack
+
+    tmp = tempfile.mkdtemp()
+    try:
+        _write(os.path.join(tmp, 'foo', 'manifest.xml'))
+        rp = RosPack(ros_paths=[tmp])
+        with rp.watch(interval=0.05) as w:
+            # a package.xml that cannot be parsed fails the refresh
+            _write(os.path.join(tmp, 'bar', 'package.xml'), '<package><name>bar')
+            assert _wait_for(lambda: w.last_error is not None)
+            assert rp.list() == ['foo']
+            _write(os.path.join(tmp, 'bar', 'package.xml'), '<package><name>bar</name></package>')
+            _write(os.path.join(tmp, 'bar', 'manifest.xml'))
+            assert _wait_for(lambda: 'bar' in rp.list())
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_refresh_during_build():
+    from rospkg import RosPack
+
+    tmp = tempfile.mkdtemp()
+    try:
+        for name in ['a', 'b', 'zz']:
+            _write(os.path.join(tmp, name, 'manifest.xml'))
+        filename = os.path.join(tmp, 'b', 'manifest.xml')
+        rp = RosPack(ros_paths=[tmp])
+        armed = []
+
+        class Manifests(dict):
+            def get(self, name, default=None):
+                m = dict.get(self, name, default)
+                if name == 'b' and m is not None and armed:
+                    # b is edited and the watcher refreshes rp right
+                    # after a build read its previous manifest
+                    del armed[:]
+                    _edit(filename, '<package><depend package="zz"/><export><cpp cflags="-Ib"/></export></package>')
+                    assert rp.refresh() == ['b']
+                return m
+        rp._manifests = Manifests()
+        builds = [
+            lambda: rp.get_depends_on('zz'),
+            lambda: rp.get_dependency_graph(),
+            lambda: rp.find_exports('cpp', 'cflags'),
+            lambda: rp.get_rosdeps('b'),
+            lambda: rp.get_depends('b'),
+        ]
+        for build in builds:
+            # discards all derived information
+            _edit(filename, '<package/>')
+            rp.refresh()
+            assert rp.get_depends('b', implicit=False) == []
+            armed.append(True)
+            build()
+            assert not armed
+            assert rp.get_depends('b', implicit=False) == ['zz']
+            assert rp.get_depends_on('zz') == ['b']
+            assert rp.get_dependency_graph().depends('b', 'zz')
+            assert rp.get_depends('b') == ['zz']
+            assert rp.find_exports('cpp', 'cflags') == [('b', '-Ib')]
+    finally:
+        shutil.rmtree(tmp)